@@ -0,0 +1,159 @@
+"""Benchmark the tag membership queries with and without indexes.
+
+Seeds a throwaway SQLite database with a synthetic membership history
+and prints EXPLAIN QUERY PLAN and timings for the membership queries,
+first without the indexes added in migration 3f1c2a9b7e4d and then
+with them. The database configured for the app is never touched.
+
+Usage: python3 benchmark.py [users] [repeat]
+"""
+import os
+import random
+import sys
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+from flask import g
+from fernet import app, db, membership
+from fernet.models import Tag, User, UserTag, tag_registry
+
+VOICES = ['Sopran 1', 'Sopran 2', 'Alt 1', 'Alt 2', 'Tenor 1', 'Tenor 2',
+          'Bas 1', 'Bas 2']
+GROUPS = ['Sånggrupp 1', 'Sånggrupp 2', 'Sånggrupp 3']
+OTHER = ['Webmaster', 'Aktiv', 'Ordförande', 'Vice ordförande',
+         'Sekreterare', 'PRoletär', 'Kassör', 'Qlubbmästare', 'Notfisqual']
+
+
+def seed(n_users):
+    """Create users with a few years worth of tag history each."""
+    random.seed(0)
+    now = datetime.utcnow()
+
+    tags = [Tag(name=name) for name in VOICES + GROUPS + OTHER]
+    db.session.add_all(tags)
+    db.session.flush()
+    tag_ids = {tag.name: tag.id for tag in tags}
+
+    db.session.execute(User.__table__.insert(), [
+        {'id': i, 'first_name': 'First{}'.format(i),
+         'last_name': 'Last{}'.format(i), 'email': 'user{}@example.com'.format(i)}
+        for i in range(1, n_users + 1)])
+
+    memberships = []
+    for user_id in range(1, n_users + 1):
+        start = now - timedelta(days=random.randint(0, 365 * 10))
+        # Roughly one in five of all users ever is still active.
+        end = None if random.random() < 0.2 else (
+            start + timedelta(days=random.randint(30, 365 * 4)))
+        names = {'Aktiv', random.choice(VOICES), random.choice(GROUPS)}
+        if random.random() < 0.05:
+            names.add(random.choice(OTHER))
+
+        for name in names:
+            memberships.append({'user_id': user_id, 'tag_id': tag_ids[name],
+                                'start': start, 'end': end})
+
+    db.session.execute(UserTag.__table__.insert(), memberships)
+    db.session.commit()
+
+    return len(memberships)
+
+
+def explain(query):
+    """Print the query plan SQLite chooses for query."""
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    params = [compiled.params[name] for name in compiled.positiontup]
+
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute('EXPLAIN QUERY PLAN ' + str(compiled), params)
+    for row in cursor.fetchall():
+        print('    ', row[-1])
+
+
+def has_tag(user):
+    # A new request would start with an empty tag snapshot.
+    g.pop('tag_snapshots', None)
+    return user.has_tag('Webmaster', 'PRoletär')
+
+
+def active_tags(user):
+    g.pop('tag_snapshots', None)
+    return user.active_tags
+
+
+def run(repeat):
+    db.session.execute('ANALYZE')
+    now = datetime.utcnow()
+    user = User.query.get(1)
+
+    plans = [
+        ('has_tag/active_tags',
+         db.session.query(UserTag.tag_id)
+         .filter(UserTag.user_id == user.id, UserTag.is_active == True)),
+        ('User.has_tag expression',
+         User.query.filter(User.has_tag('Tenor 1'), User.has_tag('Aktiv'))),
+        ('members_by_tags',
+         db.session.query(UserTag.tag_id, User)
+         .join(UserTag.user)
+         .filter(UserTag.tag_id.in_(tag_registry.ids(*VOICES)),
+                 UserTag.is_active == True,
+                 User.has_tag('Aktiv'))),
+        ('membership index',
+         db.session.query(UserTag.user_id, UserTag.tag_id,
+                          UserTag.start, UserTag.end)
+         .filter(UserTag.end.is_(None) | (UserTag.end > now))),
+        ]
+
+    for name, query in plans:
+        print('  {}:'.format(name))
+        explain(query)
+
+    timings = [
+        ('has_tag', lambda: has_tag(user)),
+        ('active_tags', lambda: active_tags(user)),
+        ('members_by_tags', lambda: User.by_tags(VOICES, ['Aktiv'])),
+        ('member_matrix', lambda: (membership.invalidate(),
+                                   membership.member_matrix(GROUPS, VOICES,
+                                                            ['Aktiv']))),
+        ]
+
+    for name, func in timings:
+        seconds = min(timeit.repeat(func, number=1, repeat=repeat))
+        print('  {:<16} {:8.3f} ms'.format(name, seconds * 1000))
+
+
+def main():
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    fd, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+
+    try:
+        with app.app_context():
+            db.create_all()
+            indexes = UserTag.__table__.indexes
+            for index in indexes:
+                index.drop(db.engine)
+
+            n_memberships = seed(n_users)
+            print('Seeded {} users and {} memberships.'
+                  .format(n_users, n_memberships))
+
+            print('\nWithout indexes:')
+            run(repeat)
+
+            for index in indexes:
+                index.create(db.engine)
+
+            print('\nWith indexes:')
+            run(repeat)
+
+            db.session.remove()
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,40 @@ BASEDIR = os.path.abspath(os.path.dirname(__file__))
 TEKNOLOGKORENSE_API_URL = 'http://localhost:5000/api'
 TEKNOLOGKORENSE_API_USERNAME = 'fernet'
 TEKNOLOGKORENSE_API_PASSWORD = 'very secure password'
+# seconds to wait for a connection and for a response, respectively
+TEKNOLOGKORENSE_API_CONNECT_TIMEOUT = 3.05
+TEKNOLOGKORENSE_API_READ_TIMEOUT = 10
+# kept-alive connections per host, should be at least the number of
+# threads per worker
+TEKNOLOGKORENSE_API_POOL_SIZE = 10
+# retries of idempotent requests, waiting backoff * 2^n seconds between
+TEKNOLOGKORENSE_API_RETRIES = 2
+TEKNOLOGKORENSE_API_BACKOFF = 0.3
+# consecutive failures before requests fail immediately, and seconds to
+# wait before trying again
+TEKNOLOGKORENSE_API_BREAKER_THRESHOLD = 5
+TEKNOLOGKORENSE_API_BREAKER_RESET = 30
+# api calls run at the same time when syncing many items, e.g. contacts
+TEKNOLOGKORENSE_API_CONCURRENCY = 4
+# seconds between syncs of the local mirror of posts and events, 0 to not
+# sync in the background
+TEKNOLOGKORENSE_MIRROR_INTERVAL = 60
+# shared secret teknologkoren.se signs change notifications with, None to
+# disable the webhook
+TEKNOLOGKORENSE_WEBHOOK_SECRET = None
+# maximum size in bytes of uploaded images
+TEKNOLOGKORENSE_API_MAX_UPLOAD = 16 * 1024 * 1024
+
+
+# Resized images
+# widths that /img<width>/ image paths may ask for
+IMAGE_SIZES = (400, 800, 1600)
+# where resized variants are kept, None for image_cache in the instance folder
+IMAGE_CACHE_DIR = None
+# bytes of resized variants to keep, least recently used are removed first
+IMAGE_CACHE_MAX_SIZE = 512 * 1024 * 1024
+# seconds browsers may cache resized images
+IMAGE_CACHE_MAX_AGE = 7 * 24 * 3600
 
 
 # SQLAlchemy
@@ -20,6 +54,42 @@ SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(BASEDIR, 'db.sqlite')
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
 
+# Logged in users
+# Seconds to cache logged in users and their tags in process, 0 to
+# disable. Changes made by other processes can take this long to apply,
+# e.g. another process may accept sessions ended by a password change,
+# or show removed tags, for this long.
+USER_CACHE_TTL = 0
+
+
+# Password hashing
+# threads hashing passwords, and hashes that may wait for one; when that
+# many are waiting, requests wait timeout seconds for a place, then fail
+PASSWORD_HASH_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+PASSWORD_HASH_QUEUE = 20
+PASSWORD_HASH_QUEUE_TIMEOUT = 5
+# bcrypt cost factor, None to pick the highest that hashes in at most
+# target seconds on this machine, but never below min rounds, which is
+# flask-bcrypt's default that existing hashes were made with. Each
+# process picks its own, set it to have all use the same.
+BCRYPT_LOG_ROUNDS = None
+PASSWORD_HASH_TARGET_TIME = 0.25
+PASSWORD_HASH_MIN_ROUNDS = 12
+
+
+# Tag registry
+# Seconds before the in-process tag catalogue is reloaded, bounds how
+# long tag changes made by other processes can take to show up.
+TAG_REGISTRY_MAX_AGE = 60
+
+
+# Tag membership index
+# Seconds before the in-process tag membership index is rebuilt. Changes
+# made by other processes are noticed before each use anyway, this only
+# bounds how long ones that slip past that check can take to show up.
+MEMBERSHIP_INDEX_MAX_AGE = 60
+
+
 # Flask-Uploads
 UPLOADS_DEFAULT_DEST = 'fernet/static/uploads/'
 UPLOADS_DEFAULT_URL = 'http://localhost:5001/static/uploads/'
@@ -31,3 +101,35 @@ SMTP_STARTTLS_PORT = 587
 SMTP_USERNAME = 'webmaster@example.com'
 SMTP_PASSWORD = 'smtpsecretpassword'
 SMTP_SENDADDR = 'webmaster@example.com'
+# False to skip STARTTLS, and an empty username to skip login, e.g. for a
+# local test server
+SMTP_STARTTLS = True
+# threads sending queued email, each with its own connection
+SMTP_WORKERS = 2
+# seconds to wait for the server, and before closing an idle connection
+SMTP_TIMEOUT = 30
+SMTP_IDLE_TIMEOUT = 60
+# retries of temporary failures, waiting backoff * 2^n seconds between
+SMTP_RETRIES = 3
+SMTP_BACKOFF = 2
+
+
+# Background jobs, run with manage.py run_worker
+# attempts before a failing job is given up, waiting backoff * 2^n
+# seconds between
+JOBS_MAX_ATTEMPTS = 5
+JOBS_BACKOFF = 10
+# seconds a job may run without a heartbeat before it is run again by
+# another worker
+JOBS_LEASE = 600
+# seconds between checks for new jobs when idle
+JOBS_POLL_INTERVAL = 1
+# seconds a job may wait past its start time before its page warns that
+# no worker seems to be running
+JOBS_OVERDUE_WARNING = 60
+
+
+# Bulk email
+# messages sent per second, and users loaded at a time
+BULK_EMAIL_RATE = 5
+BULK_EMAIL_BATCH_SIZE = 200
@@ -1,5 +1,5 @@
 import locale
-from flask import Flask, abort, request, redirect
+from flask import Flask, abort
 from flask_bcrypt import Bcrypt
 from flask_uploads import configure_uploads, IMAGES, UploadSet
 from flask_sqlalchemy import SQLAlchemy
@@ -19,6 +19,7 @@ def init_views(app):
             library,
             members,
             profile,
+            webhooks,
             )
 
     app.register_blueprint(auth.mod)
@@ -27,6 +28,7 @@ def init_views(app):
     app.register_blueprint(members.mod)
     app.register_blueprint(admin.mod)
     app.register_blueprint(library.mod)
+    app.register_blueprint(webhooks.mod)
 
 
 def setup_login_manager(app):
@@ -81,24 +83,17 @@ def setup_converters(app):
     app.url_map.converters['list'] = ListConverter
 
 
-def catch_image_resize(image_size, image):
-    """Redirect requests to resized images.
+def setup_image_resize(app):
+    """Serve resized images from the optional /img(400|800|1600)/ paths."""
+    from fernet.image_resize import resized_image
 
-    Flask's built-in server does not understand the image resize
-    path argument that nginx uses. This redirects those urls to the
-    original images.
-    """
-    if request.endpoint == 'image_resize':
-        non_resized_url = '/static/images/{}'
-    elif request.endpoint == 'upload_resize':
-        non_resized_url = '/static/uploads/images/{}'
-    else:
-        # Why are we in this functions?
-        abort(500)
-
-    non_resized_url = non_resized_url.format(image)
+    app.add_url_rule('/static/images/<image_size>/<image>',
+                     endpoint='image_resize',
+                     view_func=resized_image)
 
-    return redirect(non_resized_url)
+    app.add_url_rule('/static/uploads/images/<image_size>/<image>',
+                     endpoint='upload_resize',
+                     view_func=resized_image)
 
 
 def setup_flask_assets(app):
@@ -141,17 +136,7 @@ admin = setup_flask_admin(app)
 assets = setup_flask_assets(app)
 
 setup_converters(app)
+setup_image_resize(app)
 
 init_views(app)  # last, views might import stuff from this file
 
-
-if app.debug:
-    # If in debug mode, add rule for resized image paths to go through
-    # the redirection function.
-    app.add_url_rule('/static/images/<image_size>/<image>',
-                     endpoint='image_resize',
-                     view_func=catch_image_resize)
-
-    app.add_url_rule('/static/uploads/images/<image_size>/<image>',
-                     endpoint='upload_resize',
-                     view_func=catch_image_resize)
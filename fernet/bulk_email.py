@@ -0,0 +1,92 @@
+"""Email everyone with some tags, without holding up a request.
+
+start() saves a BulkEmail and queues a job sending it (see fernet.jobs),
+so the request that started it returns at once. Recipients are read
+from the database BULK_EMAIL_BATCH_SIZE at a time, and each message is
+rendered from admin/bulk-email.jinja2 and sent over the job's own SMTP
+connection, at most BULK_EMAIL_RATE messages per second.
+
+Only messages the mail server has accepted (or refused for good, e.g.
+for an unknown address) count as done. Progress is saved after each
+batch, so it can be followed from any process. If the server cannot be
+reached, progress is saved up to the last message sent and the job
+fails, so that its retry continues from there.
+"""
+import time
+from datetime import datetime
+from flask import render_template
+from fernet import app, db, jobs, mail
+from fernet.models import BulkEmail, User
+from fernet.util import make_email
+
+
+def recipients(tags, mandatory=None):
+    """Return query of the users with an email that would get a bulk
+    email to tags and mandatory.
+    """
+    return User.tagged(tags, mandatory).filter(User.email.isnot(None))
+
+
+def start(subject, body, tags, mandatory, sender):
+    """Start sending an email to everyone with tags and mandatory.
+
+    Returns the BulkEmail, which is updated as messages are sent.
+    """
+    bulk = BulkEmail(subject=subject, body=body, tags='+'.join(tags),
+                     mandatory='+'.join(mandatory) if mandatory else None,
+                     sender=sender, total=recipients(tags, mandatory).count())
+    db.session.add(bulk)
+    db.session.commit()
+
+    bulk.job = send.enqueue(bulk.id)
+    db.session.commit()
+
+    return bulk
+
+
+@jobs.task
+def send(bulk_id):
+    """Send bulk email with id bulk_id, see module docstring."""
+    bulk = BulkEmail.query.get(bulk_id)
+    if bulk.finished:
+        return bulk.sent
+
+    interval = 1 / app.config['BULK_EMAIL_RATE']
+    next_send = time.monotonic()
+
+    batches = User.in_batches(recipients(bulk.tag_list, bulk.mandatory_list),
+                              app.config['BULK_EMAIL_BATCH_SIZE'],
+                              after=bulk.last_user_id)
+
+    with mail.Connection() as connection:
+        for users in batches:
+            for user in users:
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_send = max(next_send, time.monotonic()) + interval
+
+                body = render_template('admin/bulk-email.jinja2',
+                                       user=user, body=bulk.body)
+                try:
+                    connection.send(make_email(user.email, bulk.subject,
+                                               body))
+                except mail.DeliveryFailed as e:
+                    if not e.permanent:
+                        db.session.commit()
+                        raise
+
+                    app.logger.warning(str(e))
+                    bulk.failed += 1
+                else:
+                    bulk.sent += 1
+
+                bulk.last_user_id = user.id
+
+            db.session.commit()
+            jobs.heartbeat()
+
+    bulk.finished = datetime.utcnow()
+    db.session.commit()
+
+    return bulk.sent
@@ -1,11 +1,13 @@
-from functools import partialmethod
+import threading
+from collections import OrderedDict
+from functools import partial, partialmethod
 from flask import flash, url_for, redirect
 from wtforms import fields, validators
 import wtforms.fields.html5 as html5_fields
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileAllowed
 from fernet import db, images
-from fernet.models import User, UserTag
+from fernet.models import User
 from fernet.util import get_redirect_target, is_safe_url
 
 
@@ -30,7 +32,42 @@ class TagForm:
 
     We make sure not to setattr the base as this will modify it
     process wide, instead we let a new class inherit from the base.
+
+    Creating form classes is slow, so the generated classes are cached
+    per tag catalogue, the ids and names of the tags. The classes are
+    therefore the same for all users, which tags are checked for a user
+    is decided when the form is created.
     """
+    _classes = OrderedDict()
+    _classes_lock = threading.Lock()
+    _max_classes = 32
+
+    @classmethod
+    def cached_class(cls, key, build):
+        """Return the form class cached for key, calling build if missing.
+
+        The key should include the tag catalogue the class was built
+        from, see catalogue.
+        """
+        with cls._classes_lock:
+            if key in cls._classes:
+                cls._classes.move_to_end(key)
+                return cls._classes[key]
+
+        form_class = build()
+
+        with cls._classes_lock:
+            cls._classes[key] = form_class
+            while len(cls._classes) > cls._max_classes:
+                cls._classes.popitem(last=False)
+
+        return form_class
+
+    @staticmethod
+    def catalogue(tags):
+        """Return tuple of (id, name) of tags, for use in cache keys."""
+        return tuple((tag.id, tag.name) for tag in tags)
+
     @classmethod
     def extend_form(cls, base, tags, user=None):
         """Return an extended form with tag fields and user modifying method.
@@ -40,79 +77,98 @@ class TagForm:
             tags: the tags to extend the form with
             user: a user to check tags against (optional)
 
-        If a user is passed, check the fields of the tags that the user
-        has, and set set_user_tags as a method with arguments attached.
-        Also set user as an attribute of the extended form.
+        If a user is passed, the form checks the fields of the tags
+        that the user has, has the user as an attribute and a
+        set_user_tags method updating the user. The user is given to
+        the form when it is created, so a form factory taking the same
+        arguments as base is returned rather than the class itself.
         """
-        class ExtendedBase(base):
-            pass
+        catalogue = cls.catalogue(tags)
 
-        Tags = cls.tag_form(tags, user)
-        ExtendedBase.tags = fields.FormField(Tags)
+        ExtendedBase = cls.cached_class(
+            ('extend_form', base, catalogue),
+            lambda: cls._extend_form(base, catalogue))
 
         if user:
-            ExtendedBase.user = user
-            # Add TagForm.set_user_tags to Tags together with arguments.
-            ExtendedBase.set_user_tags = partialmethod(cls.set_user_tags, user)
+            return partial(ExtendedBase, tag_user=user)
+
+        return ExtendedBase
+
+    @classmethod
+    def _extend_form(cls, base, catalogue):
+        class ExtendedBase(base):
+            tags = fields.FormField(cls._tag_form(catalogue))
+
+            def __init__(self, *args, tag_user=None, **kwargs):
+                super().__init__(*args, **kwargs)
+
+                if tag_user:
+                    self.user = tag_user
+
+                    if not self.is_submitted():
+                        # Check the user's tags by processing the tag
+                        # form again, with the user's tags as data.
+                        checked_ids = tag_user.active_tag_ids
+                        self.tags.process(None, {
+                            name: tag_id in checked_ids
+                            for tag_id, name in catalogue})
+
+            def set_user_tags(self):
+                cls.set_user_tags(self, self.user)
 
         return ExtendedBase
 
     @classmethod
-    def tag_form(cls, tags, user=None):
+    def tag_form(cls, tags):
+        """Return a form with a checkbox for each tag."""
+        catalogue = cls.catalogue(tags)
+
+        return cls.cached_class(('tag_form', catalogue),
+                                lambda: cls._tag_form(catalogue))
+
+    @classmethod
+    def _tag_form(cls, catalogue):
         class Tags(FlaskForm):
             pass
 
-        for tag in tags:
-            # If user has this tag, set its value to checked
-            if user and user.has_tag(tag.name):
-                field = fields.BooleanField(tag.name, default=True)
-            else:
-                field = fields.BooleanField(tag.name)
-
+        for tag_id, name in catalogue:
             # Add the field to this class with the name of the tag
-            setattr(Tags, tag.name, field)
+            setattr(Tags, name, fields.BooleanField(name))
 
-        Tags.tags = tags
+        Tags.tags = catalogue
         Tags.checked_tags = partialmethod(cls.checked_tags)
 
         return Tags
 
     def checked_tags(self):
-        """Get list of checked tags."""
-        tags = self.tags
+        """Get list of names of checked tags."""
         checked = []
-        for tag in tags:
-            tag_field = getattr(self, tag.name)
+        for tag_id, name in self.tags:
+            tag_field = getattr(self, name)
 
             if tag_field.data:
-                checked.append(tag.name)
+                checked.append(name)
 
         return checked
 
     @staticmethod
     def set_user_tags(form, user):
-        """Update user with new and removed tags."""
+        """Update user with new and removed tags.
+
+        Changes are added to the session, committing is up to the
+        caller.
+        """
         tag_form = form.tags
-        for tag in tag_form.tags:
-            tag_field = getattr(tag_form, tag.name)
+        checked = [tag_id for tag_id, name in tag_form.tags
+                   if getattr(tag_form, name).data]
 
-            # If tag field is checked and the user did not already
-            # have that tag, give user tag
-            if tag_field.data and not user.has_tag(tag.name):
-                user_tag = UserTag()
-                user_tag.tag = tag
-                user.tags.append(user_tag)
+        User.set_tags({user: checked},
+                      [tag_id for tag_id, name in tag_form.tags])
 
-            # If tag field isn't checked but the user has that tag,
-            # remove it.
-            elif not tag_field.data and user.has_tag(tag.name):
-                user_tag = UserTag.query.filter(UserTag.user == user,
-                                                UserTag.tag == tag,
-                                                UserTag.is_active == True
-                                                ).one()
-                user_tag.end_association()
 
-        db.session.commit()
+class FilterMembersForm(FlaskForm):
+    """Base of the member filter form, see views.members.filter_members."""
+    only_active = fields.BooleanField('Only active members', default=True)
 
 
 class LowercaseEmailField(html5_fields.EmailField):
@@ -341,6 +397,16 @@ class UpdateContactsForm(FlaskForm):
     pass
 
 
+class BulkEmailForm(FlaskForm):
+    subject = fields.StringField('Subject', validators=[
+        validators.InputRequired(),
+        validators.Length(max=200)
+        ])
+    body = fields.TextAreaField('Message', validators=[
+        validators.InputRequired()
+        ])
+
+
 class EditScoreForm(FlaskForm):
     name = fields.StringField('Score name', validators=[
         validators.InputRequired()
@@ -0,0 +1,160 @@
+"""Resized variants of images, generated once and cached on disk.
+
+Image urls may have a size argument in the path, e.g.
+/static/images/img800/logo.png, which in production used to be handled
+by nginx only. The variants are generated with Pillow the first time
+they are requested and stored in IMAGE_CACHE_DIR, named by a hash of
+the original's content and the size, so that identical images share
+variants and a changed image gets new ones. The cache is kept below
+IMAGE_CACHE_MAX_SIZE bytes by evicting the least recently used
+variants.
+
+If Pillow is not installed, or cannot read the image (e.g. svg, or
+one that is too large to decode), requests are redirected to the
+original image instead.
+"""
+import functools
+import hashlib
+import os
+import tempfile
+import threading
+from flask import abort, redirect, request, send_file
+from werkzeug.security import safe_join
+from fernet import app, images
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+_evict_lock = threading.Lock()
+
+
+def cache_dir():
+    return (app.config['IMAGE_CACHE_DIR'] or
+            os.path.join(app.instance_path, 'image_cache'))
+
+
+def content_hash(path):
+    """Return hash of the file at path, remembered until it changes."""
+    stat = os.stat(path)
+    return _file_hash(path, stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=1024)
+def _file_hash(path, mtime_ns, size):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def resize(source, target, width):
+    """Save source scaled down to width (keeping aspect ratio) as target.
+
+    Writes to a temporary file that is then moved in place, so a
+    variant is either complete or missing, never half written.
+    """
+    with Image.open(source) as original:
+        image_format = original.format
+        image = ImageOps.exif_transpose(original)
+        image.thumbnail((width, image.height))
+
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if image_format == 'JPEG':
+                    image.save(f, image_format, quality=85, optimize=True)
+                else:
+                    image.save(f, image_format)
+            os.replace(tmp, target)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+
+def evict(directory, max_size, keep=None):
+    """Remove least recently used variants until below max_size bytes.
+
+    The variant at path keep is never removed, even if it alone is
+    larger than max_size.
+    """
+    with _evict_lock:
+        variants = []
+        for entry in os.scandir(directory):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            # Hits touch the variant, so mtime is the time of last use.
+            variants.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in variants)
+        for _, size, path in sorted(variants):
+            if total <= max_size:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def resized_image(image_size, image):
+    """Serve image resized to image_size, e.g. 'img800'."""
+    if request.endpoint == 'image_resize':
+        directory = os.path.join(app.static_folder, 'images')
+        original_url = '/static/images/{}'
+    else:
+        directory = images.config.destination
+        original_url = '/static/uploads/images/{}'
+
+    if not image_size.startswith('img'):
+        abort(404)
+
+    try:
+        width = int(image_size[3:])
+    except ValueError:
+        abort(404)
+
+    if width not in app.config['IMAGE_SIZES']:
+        abort(404)
+
+    source = safe_join(directory, image)
+    if source is None or not os.path.isfile(source):
+        abort(404)
+
+    if Image is None:
+        return redirect(original_url.format(image))
+
+    target_dir = cache_dir()
+    os.makedirs(target_dir, exist_ok=True)
+
+    variant = '{}-{}'.format(content_hash(source), width)
+    target = os.path.join(target_dir,
+                          variant + os.path.splitext(image)[1].lower())
+
+    if os.path.exists(target):
+        os.utime(target)
+    else:
+        try:
+            resize(source, target, width)
+        except (OSError, Image.DecompressionBombError):
+            # Not an image Pillow can read, e.g. svg, or one that would
+            # take too much memory to decode.
+            return redirect(original_url.format(image))
+        evict(target_dir, app.config['IMAGE_CACHE_MAX_SIZE'], keep=target)
+
+    response = send_file(target)
+
+    # The variant's name already identifies its content, unlike the
+    # mtime based etag, which changes every time the variant is used.
+    response.set_etag(variant)
+    response.last_modified = None
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['IMAGE_CACHE_MAX_AGE']
+
+    return response.make_conditional(request)
@@ -0,0 +1,187 @@
+"""Durable background jobs, kept in the database.
+
+Views queue work with a task's enqueue(*args) and return at once. The
+jobs are run by worker processes started with
+
+    python manage.py run_worker
+
+so a slow teknologkoren.se or SMTP server holds up a worker rather than
+a request. Jobs are rows in the job table, so queued jobs survive
+restarts of both the site and the workers, and no broker is needed.
+
+A job that raises is tried again, at most JOBS_MAX_ATTEMPTS times in
+all, waiting JOBS_BACKOFF * 2^n seconds between. A job that has been
+running for more than JOBS_LEASE seconds is assumed to have lost its
+worker and is picked up by another, unless the task calls heartbeat()
+meanwhile. Tasks must therefore be safe to run more than once.
+"""
+import json
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from functools import partial
+from fernet import app, db
+from fernet.models import Job
+
+# task name -> function, see task
+tasks = {}
+
+# the job being run by the current worker thread, see heartbeat
+_current = threading.local()
+
+
+class TaskFailed(Exception):
+    """Raised by tasks that fail without an exception of their own."""
+
+
+def task(func):
+    """Register func as a task that can be run as a job.
+
+    Adds func.enqueue(*args), which queues a job calling func(*args)
+    and returns the Job. args must be json serializable.
+    """
+    name = '{}.{}'.format(func.__module__, func.__name__)
+    tasks[name] = func
+    func.enqueue = partial(enqueue, name)
+    return func
+
+
+def enqueue(name, *args):
+    """Queue a job calling the task called name with args."""
+    job = Job(task=name, args=json.dumps(args))
+    db.session.add(job)
+    db.session.commit()
+
+    return job
+
+
+def claimable(now):
+    """Return filter for jobs that a worker may start at now."""
+    stale = now - timedelta(seconds=app.config['JOBS_LEASE'])
+    return (((Job.status == 'queued') & (Job.run_after <= now)) |
+            ((Job.status == 'running') & (Job.started < stale)))
+
+
+def claim():
+    """Mark the next job to run as running and return it, or None.
+
+    A job is claimed with an UPDATE that only succeeds if it is still
+    claimable, so two workers never run the same job.
+    """
+    now = datetime.utcnow()
+    candidates = (db.session.query(Job.id)
+                  .filter(claimable(now))
+                  .order_by(Job.run_after, Job.id)
+                  .limit(10)
+                  .all())
+
+    for job_id, in candidates:
+        claimed = (Job.query
+                   .filter(Job.id == job_id, claimable(now))
+                   .update({'status': 'running',
+                            'started': now,
+                            'attempts': Job.attempts + 1},
+                           synchronize_session=False))
+        db.session.commit()
+
+        if claimed:
+            return Job.query.get(job_id)
+
+    return None
+
+
+def overdue(job):
+    """Return True if job should have been started a while ago.
+
+    That usually means that no worker is running.
+    """
+    late = datetime.utcnow() - timedelta(
+            seconds=app.config['JOBS_OVERDUE_WARNING'])
+    return job.status == 'queued' and job.run_after < late
+
+
+def heartbeat():
+    """Tell that the current job is still running, see module docstring."""
+    job_id = getattr(_current, 'job_id', None)
+    if job_id is not None:
+        Job.query.filter_by(id=job_id).update(
+            {'started': datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+
+
+def run(job):
+    """Run job and record its result, or schedule a retry if it fails."""
+    max_attempts = app.config['JOBS_MAX_ATTEMPTS']
+    _current.job_id = job.id
+
+    try:
+        if job.attempts > max_attempts:
+            raise TaskFailed('Stopped while running and out of attempts.')
+
+        func = tasks.get(job.task)
+        if func is None:
+            raise TaskFailed('No task called {}.'.format(job.task))
+
+        result = func(*json.loads(job.args))
+    except Exception:
+        db.session.rollback()
+        app.logger.exception('Job %d (%s) failed', job.id, job.task)
+
+        job.error = traceback.format_exc()
+        if job.attempts < max_attempts:
+            job.status = 'queued'
+            job.run_after = datetime.utcnow() + timedelta(
+                seconds=app.config['JOBS_BACKOFF'] * 2 ** (job.attempts - 1))
+        else:
+            job.status = 'failed'
+            job.finished = datetime.utcnow()
+    else:
+        job.status = 'done'
+        job.result = json.dumps(result)
+        job.finished = datetime.utcnow()
+    finally:
+        _current.job_id = None
+
+    db.session.commit()
+
+
+def work():
+    """Run jobs as they come, until the process is stopped."""
+    with app.app_context():
+        while True:
+            try:
+                job = claim()
+                if job is not None:
+                    run(job)
+            except Exception:
+                # Keep the worker, e.g. through a lost database
+                # connection. A job it was running is run again when its
+                # lease is out.
+                app.logger.exception('Job worker failed')
+                db.session.rollback()
+                job = None
+            finally:
+                db.session.remove()
+
+            if job is None:
+                time.sleep(app.config['JOBS_POLL_INTERVAL'])
+
+
+def run_worker(threads=1):
+    """Run jobs in threads threads, until interrupted."""
+    workers = [threading.Thread(target=work, name='jobs-{}'.format(i),
+                                daemon=True)
+               for i in range(threads)]
+    for worker in workers:
+        worker.start()
+
+    try:
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(60)
+    except KeyboardInterrupt:
+        return
+
+    # Exit with an error rather than idle, so that whatever runs the
+    # worker restarts it.
+    raise SystemExit('All job worker threads have stopped')
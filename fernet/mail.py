@@ -0,0 +1,190 @@
+"""Sending email over kept-open SMTP connections.
+
+A Connection opens its SMTP connection (STARTTLS and login done once)
+when the first message is sent and sends message after message over
+it. Sending is retried SMTP_RETRIES times with exponential backoff on
+temporary errors (4xx replies and lost connections), reconnecting
+first. If a message cannot be sent, DeliveryFailed is raised, telling
+whether the error was permanent (5xx replies, refused recipients).
+
+Most email is put in mail_queue, sent by a fixed pool of worker
+threads with a Connection each. A connection that has been idle for
+SMTP_IDLE_TIMEOUT seconds is closed, servers drop idle clients anyway,
+and a new one is opened for the next message. Code that needs to know
+that its messages were sent, like bulk email, uses a Connection of its
+own instead.
+
+The workers are started with the first message, so processes that
+never send email (e.g. manage.py commands) start no threads.
+"""
+import atexit
+import queue
+import smtplib
+import ssl
+import threading
+import time
+from fernet import app
+
+
+class DeliveryFailed(Exception):
+    """Raised when a message could not be sent.
+
+    permanent is True if the server refused the message or its
+    recipients, False if it may be sent later.
+    """
+    def __init__(self, msg, error, permanent):
+        super().__init__('Failed to send email to {}: {}'
+                         .format(msg['To'], error))
+        self.error = error
+        self.permanent = permanent
+
+
+class Connection:
+    """SMTP connection, opened when needed and reopened after errors."""
+    def __init__(self):
+        self.smtp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def connect():
+        """Return an SMTP connection that is ready to send."""
+        smtp = smtplib.SMTP(app.config['SMTP_MAILSERVER'],
+                            port=app.config['SMTP_STARTTLS_PORT'],
+                            timeout=app.config['SMTP_TIMEOUT'])
+        try:
+            if app.config['SMTP_STARTTLS']:
+                # See send_email for the choice of context.
+                smtp.starttls(context=ssl.create_default_context())
+            if app.config['SMTP_USERNAME']:
+                smtp.login(app.config['SMTP_USERNAME'],
+                           app.config['SMTP_PASSWORD'])
+        except BaseException:
+            smtp.close()
+            raise
+
+        return smtp
+
+    def close(self):
+        """Close the connection, if open."""
+        if self.smtp is None:
+            return
+
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self.smtp.close()
+        self.smtp = None
+
+    def send(self, msg):
+        """Send msg, see module docstring.
+
+        In debug mode msg is printed instead.
+        """
+        if app.debug:
+            print(msg)
+            return
+
+        retries = app.config['SMTP_RETRIES']
+
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(app.config['SMTP_BACKOFF'] * 2 ** (attempt - 1))
+
+            if self.smtp is None:
+                try:
+                    self.smtp = self.connect()
+                except (smtplib.SMTPException, OSError) as e:
+                    # Even 5xx replies here, e.g. to a failed login, are
+                    # about the server and not msg, so they are retried.
+                    error = e
+                    continue
+
+            try:
+                self.smtp.send_message(msg)
+                return
+            except smtplib.SMTPRecipientsRefused as e:
+                raise DeliveryFailed(msg, e, permanent=True)
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code >= 500:
+                    raise DeliveryFailed(msg, e, permanent=True)
+                error = e
+            except (smtplib.SMTPException, OSError) as e:
+                error = e
+
+            # Start over with a new connection.
+            if self.smtp is not None:
+                self.smtp.close()
+                self.smtp = None
+
+        raise DeliveryFailed(msg, 'gave up after {} attempts: {}'
+                             .format(retries + 1, error), permanent=False)
+
+
+class MailQueue:
+    """Fixed pool of workers sending the EmailMessages put in a queue."""
+    def __init__(self, workers):
+        self.n_workers = workers
+        self.queue = queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def put(self, msg):
+        """Queue msg to be sent, starting the workers if not running."""
+        with self.lock:
+            if not self.workers:
+                for i in range(self.n_workers):
+                    worker = threading.Thread(target=self.work,
+                                              name='mail-{}'.format(i),
+                                              daemon=True)
+                    worker.start()
+                    self.workers.append(worker)
+
+        self.queue.put(msg)
+
+    def stop(self, timeout=None):
+        """Send what is queued, then stop the workers."""
+        with self.lock:
+            for _ in self.workers:
+                self.queue.put(None)
+
+            deadline = None if timeout is None else time.monotonic() + timeout
+            for worker in self.workers:
+                worker.join(None if deadline is None
+                            else max(0, deadline - time.monotonic()))
+
+            self.workers = []
+
+    def work(self):
+        connection = Connection()
+
+        while True:
+            try:
+                msg = self.queue.get(timeout=app.config['SMTP_IDLE_TIMEOUT'])
+            except queue.Empty:
+                connection.close()
+                continue
+
+            try:
+                if msg is None:
+                    connection.close()
+                    return
+
+                connection.send(msg)
+            except DeliveryFailed as e:
+                app.logger.error(str(e))
+            except Exception:
+                # Keep the worker, the pool would shrink for good.
+                app.logger.exception('Failed to send email to %s',
+                                     msg['To'])
+                connection.close()
+            finally:
+                self.queue.task_done()
+
+
+mail_queue = MailQueue(app.config['SMTP_WORKERS'])
+atexit.register(mail_queue.stop, timeout=10)
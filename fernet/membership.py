@@ -0,0 +1,187 @@
+"""In-process index of which users have which tags.
+
+Each tag maps to a bitset of the ids of the users that currently have
+the tag, stored as a plain int where bit n is set if user n has the
+tag. Set algebra on members (e.g. everyone in both 'Tenor 1' and
+'Sånggrupp 2' that is also 'Aktiv') is then a couple of integer
+operations instead of one database query per combination.
+
+The index is built from a single scan of UserTag and shared by the
+whole process. It is thrown away when a session commits changes to
+UserTag or Tag, when an association starts or ends by the passing of
+time, and after MEMBERSHIP_INDEX_MAX_AGE seconds.
+
+Changes committed by other processes are caught by a one-row query
+before each use, comparing the highest id, the number of rows and of
+ended rows, and the latest end of UserTag with what they were when the
+index was built. Associations are only inserted, ended or deleted, and
+each of those changes one of them.
+"""
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import func
+from fernet import app, db
+from fernet.models import Tag, User, UserTag, on_commit, tag_registry
+
+
+def iter_ids(bits):
+    """Yield the user ids in bitset bits, in ascending order."""
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+class MembershipIndex:
+    """Bitsets of active user ids per tag name, see module docstring."""
+    def __init__(self, memberships, now, version=None):
+        """Build index from (user_id, tag_id, start, end) tuples.
+
+        Associations that start or end after now are not active yet,
+        but they decide how long the index is valid. version is what
+        version() returned before memberships were read.
+        """
+        self.bitsets = {}
+        self.valid_until = None
+        self.version = version
+
+        for user_id, tag_id, start, end in memberships:
+            for change in (start, end):
+                if change and change > now:
+                    if not self.valid_until or change < self.valid_until:
+                        self.valid_until = change
+
+            tag = tag_registry.get(tag_id)
+            if tag and start <= now and (end is None or now < end):
+                self.bitsets[tag.name] = (self.bitsets.get(tag.name, 0)
+                                          | 1 << user_id)
+
+        self.built = time.monotonic()
+
+    @staticmethod
+    def version():
+        """Return a summary of UserTag that changes with every commit to
+        it, see module docstring.
+        """
+        return tuple(db.session.query(func.max(UserTag.id),
+                                      func.count(UserTag.id),
+                                      func.count(UserTag.end),
+                                      func.max(UserTag.end)).one())
+
+    @classmethod
+    def load(cls, version):
+        """Build an index from the database with a single query."""
+        now = datetime.utcnow()
+        memberships = (db.session.query(UserTag.user_id, UserTag.tag_id,
+                                        UserTag.start, UserTag.end)
+                       .filter(UserTag.end.is_(None) | (UserTag.end > now)))
+
+        return cls(memberships, now, version)
+
+    def is_fresh(self, version):
+        """Return False if the index may be out of date."""
+        if version != self.version:
+            return False
+
+        max_age = app.config['MEMBERSHIP_INDEX_MAX_AGE']
+        if time.monotonic() - self.built > max_age:
+            return False
+
+        if self.valid_until and datetime.utcnow() >= self.valid_until:
+            return False
+
+        return True
+
+    def any_of(self, *tags):
+        """Return bitset of users with at least one of tags."""
+        bits = 0
+        for tag in tags:
+            bits |= self.bitsets.get(tag, 0)
+        return bits
+
+    def all_of(self, *tags, within=None):
+        """Return bitset of users with all of tags.
+
+        If within is given, only users in that bitset are considered.
+        Without any tags or within, this is every user with a tag.
+        """
+        bits = self.any_of(*self.bitsets) if within is None else within
+        for tag in tags:
+            bits &= self.bitsets.get(tag, 0)
+        return bits
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_index():
+    """Return the process wide index, rebuilding it if stale."""
+    global _index
+
+    version = MembershipIndex.version()
+
+    index = _index
+    if index is None or not index.is_fresh(version):
+        with _lock:
+            index = _index
+            if index is None or not index.is_fresh(version):
+                index = _index = MembershipIndex.load(version)
+
+    return index
+
+
+def invalidate():
+    """Throw away the index, the next get_index() will rebuild it."""
+    global _index
+    _index = None
+
+
+def load_users(bits):
+    """Return dict of user id -> User for all users in bitset bits."""
+    ids = list(iter_ids(bits))
+    if not ids:
+        return {}
+
+    users = User.query.filter(User.id.in_(ids)).order_by(User.first_name)
+    return {user.id: user for user in users}
+
+
+def member_matrix(columns, rows, mandatory=None):
+    """Return tag_dict[column][row] -> users with both tags.
+
+    Users must also have all tags in mandatory. The users in each cell
+    are ordered by first name. Costs one query checking the index and one
+    for the users, plus one if the index has to be rebuilt.
+    """
+    index = get_index()
+    members = index.all_of(*mandatory or [])
+
+    cells = {}
+    for column in columns:
+        column_members = index.all_of(column, within=members)
+        cells[column] = {row: index.all_of(row, within=column_members)
+                         for row in rows}
+
+    shown = 0
+    for column in cells.values():
+        for bits in column.values():
+            shown |= bits
+
+    users = load_users(shown)
+
+    tag_dict = {}
+    for column in columns:
+        tag_dict[column] = {}
+        for row in rows:
+            bits = cells[column][row]
+            tag_dict[column][row] = [user for user_id, user in users.items()
+                                     if bits >> user_id & 1]
+
+    return tag_dict
+
+
+@on_commit(UserTag, Tag)
+def _invalidate_on_commit(keys):
+    invalidate()
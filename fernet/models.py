@@ -1,10 +1,69 @@
-import random
 import requests
-import string
+import threading
+import time
+from collections import OrderedDict, namedtuple
 from datetime import datetime
+from flask import g, has_app_context
 from flask_login import UserMixin
+from sqlalchemy import event
 from sqlalchemy.ext.hybrid import hybrid_method, hybrid_property
-from fernet import app, db, bcrypt
+from sqlalchemy.orm import Session
+from fernet import app, db, passwords
+
+
+def invalidate_tag_snapshot(user_id):
+    """Drop the per-request tag snapshot of a user, see User.has_tag."""
+    if has_app_context():
+        g.get('tag_snapshots', {}).pop(user_id, None)
+
+
+# (types, key, callback) of each on_commit callback
+_commit_callbacks = []
+
+
+def on_commit(*types, key=lambda obj: None):
+    """Decorate callback(keys) to be called after commits that change
+    instances of types.
+
+    keys is the set of key(obj) of the instances added, changed or
+    deleted by the transaction. Keys are taken when the changes are
+    flushed, as the instances are expired (or gone) once committed.
+    Changes that are rolled back are forgotten. Used to drop in-process
+    caches of the database.
+    """
+    def decorator(callback):
+        _commit_callbacks.append((types, key, callback))
+        return callback
+    return decorator
+
+
+def note_change(session, obj):
+    """Tell on_commit callbacks that obj changes in session.
+
+    Done for every instance flushed by the ORM, call it for changes
+    made without, e.g. bulk inserts.
+    """
+    changes = session.info.setdefault('changes', {})
+    for i, (types, key, _) in enumerate(_commit_callbacks):
+        if isinstance(obj, types):
+            changes.setdefault(i, set()).add(key(obj))
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_changes(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        note_change(session, obj)
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_commit_callbacks(session):
+    for i, keys in session.info.pop('changes', {}).items():
+        _commit_callbacks[i][2](keys)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changes(session):
+    session.info.pop('changes', None)
 
 
 class UserTag(db.Model):
@@ -12,9 +71,24 @@ class UserTag(db.Model):
 
     Uses the 'association object pattern' to be able to save extra data
     in the associations.
+
+    Each association is one interval of membership. Ending an
+    association keeps it as history, and taking the tag again starts a
+    new one.
+
+    The indexes cover the tag membership lookups: users by tag and
+    tags by user, both with the interval columns used by is_active.
     """
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
-    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id'), primary_key=True)
+    __table_args__ = (
+        db.Index('ix_user_tag_tag_id_user_id_start_end',
+                 'tag_id', 'user_id', 'start', 'end'),
+        db.Index('ix_user_tag_user_id_tag_id_start_end',
+                 'user_id', 'tag_id', 'start', 'end'),
+        )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id'), nullable=False)
 
     user = db.relationship('User', back_populates='tags')
     tag = db.relationship('Tag', back_populates='users')
@@ -31,8 +105,24 @@ class UserTag(db.Model):
 
         return has_started & not_ended
 
+    @hybrid_method
+    def was_active(self, start, end=None):
+        """Return True if association was active at some time in [start, end].
+
+        Without end, check if it was active at the time start.
+        """
+        end = end or start
+        return self.start <= end and (self.end is None or start < self.end)
+
+    @was_active.expression
+    def was_active(cls, start, end=None):
+        """Return a filter on associations active some time in [start, end]."""
+        end = end or start
+        return (cls.start <= end) & (cls.end.is_(None) | (start < cls.end))
+
     def end_association(self):
         self.end = datetime.utcnow()
+        invalidate_tag_snapshot(self.user_id)
 
     def __str__(self):
         return "UserTag({}/{})".format(self.user, self.tag)
@@ -60,9 +150,10 @@ class User(UserMixin, db.Model):
 
     def __init__(self, *args, **kwargs):
         if 'password' not in kwargs:
-            password = ''.join(random.choice(string.ascii_letters +
-                                             string.digits) for _ in range(30))
-            kwargs['password'] = password
+            # No usable password until the first reset, hashing one
+            # nobody will use only costs time.
+            kwargs['_password'] = passwords.UNUSABLE
+            kwargs['_password_timestamp'] = datetime.utcnow()
 
         super().__init__(*args, **kwargs)
 
@@ -74,29 +165,90 @@ class User(UserMixin, db.Model):
     @password.setter
     def password(self, plaintext):
         """Generate and save password hash, update password timestamp."""
-        self._password = bcrypt.generate_password_hash(plaintext)
+        self._password = passwords.generate(plaintext)
 
         # Save in UTC, password resets compare this to UTC time!
         self._password_timestamp = datetime.utcnow()
 
+    @property
+    def password_stamp(self):
+        """Return a string that changes whenever the password does."""
+        if self._password_timestamp is None:
+            return ''
+        return self._password_timestamp.isoformat()
+
+    def get_id(self):
+        """Return the id flask-login keeps in the session.
+
+        It includes password_stamp, so that changing the password ends
+        all sessions started with the old one, see auth.load_user.
+        """
+        return '{}:{}'.format(self.id, self.password_stamp)
+
     def verify_password(self, plaintext):
         """Return True if plaintext matches password, else return False."""
-        return bcrypt.check_password_hash(self._password, plaintext)
+        if not passwords.usable(self._password):
+            return False
+
+        return passwords.check(self._password, plaintext)
+
+    def _tag_snapshot(self):
+        """Return a frozenset of the ids of the user's active tags.
+
+        The snapshot is fetched with a single query and kept on `g` for
+        the rest of the request, so that any number of permission
+        checks in views and templates only cost one query. It is
+        dropped by `invalidate_tag_snapshot` whenever the user's tags
+        change.
+        """
+        if self.id is None:
+            # Not saved yet, so it can't have any tags in the database.
+            return frozenset()
+
+        if has_app_context():
+            snapshot = g.get('tag_snapshots', {}).get(self.id)
+            if snapshot is not None:
+                return snapshot
+
+        tag_ids = (db.session.query(UserTag.tag_id)
+                   .filter(UserTag.user_id == self.id,
+                           UserTag.is_active == True))
+
+        return self.preload_tags(tag_id for tag_id, in tag_ids)
+
+    def preload_tags(self, tag_ids):
+        """Use tag_ids as the user's active tags for the rest of the request.
+
+        Lets code that already has the active tags, like the user
+        loader, save has_tag a query. Returns the new snapshot.
+        """
+        snapshot = frozenset(tag_ids)
+
+        if has_app_context():
+            g.setdefault('tag_snapshots', {})[self.id] = snapshot
+
+        return snapshot
 
     @property
     def active_tags(self):
-        return [user_tag.tag
-                for user_tag
-                in UserTag.query.filter(UserTag.user == self,
-                                        UserTag.is_active == True
-                                        )]
+        """Return the user's active tags as TagInfo, sorted by name."""
+        tags = filter(None, map(tag_registry.get, self._tag_snapshot()))
+        return sorted(tags, key=lambda tag: tag.name)
+
+    @property
+    def active_tag_ids(self):
+        return self._tag_snapshot()
 
     @hybrid_method
     def has_tag(self, *tags, active=True):
         """Return True if User instance has at least one of tags."""
+        if active:
+            tag_ids = tag_registry.ids(*tags)
+            return not self._tag_snapshot().isdisjoint(tag_ids)
+
         has_tag = UserTag.query.filter(
             UserTag.user == self,
-            UserTag.tag.has(Tag.name.in_(tags)),
+            UserTag.tag_id.in_(tag_registry.ids(*tags)),
             UserTag.is_active == active
             ).scalar()
 
@@ -105,9 +257,148 @@ class User(UserMixin, db.Model):
     @has_tag.expression
     def has_tag(self, *tags, active=True):
         """Return an Exists with all Users that has at least one of tags."""
-        return self.tags.any(UserTag.tag.has(Tag.name.in_(tags)),
+        return self.tags.any(UserTag.tag_id.in_(tag_registry.ids(*tags)),
                              is_active=active)
 
+    @staticmethod
+    def set_tags(wanted, tag_ids):
+        """Give users exactly the wanted tags out of tag_ids.
+
+        Arguments:
+            wanted: dict of user -> ids of the tags that user should have
+            tag_ids: ids of the tags to update, other tags are kept
+
+        Works out which associations to start and end from the users'
+        active associations, which are loaded with a single query.
+        Associations are ended rather than removed, and a tag that is
+        taken again gets a new association, so the history of earlier
+        ones is kept. The new associations are inserted with a single
+        executemany INSERT, and the ended ones are flushed together with
+        one executemany UPDATE, as part of the caller's transaction.
+        Nothing is committed here.
+        """
+        now = datetime.utcnow()
+
+        if any(user.id is None for user in wanted):
+            # New users need their ids for the INSERT.
+            db.session.flush()
+
+        user_ids = [user.id for user in wanted]
+        active = {}
+        if user_ids and tag_ids:
+            user_tags = UserTag.query.filter(UserTag.user_id.in_(user_ids),
+                                             UserTag.tag_id.in_(tag_ids),
+                                             UserTag.was_active(now))
+
+            for user_tag in user_tags:
+                active[user_tag.user_id, user_tag.tag_id] = user_tag
+
+        rows = []
+        for user, user_tags in wanted.items():
+            user_tags = set(user_tags)
+            started = False
+
+            for tag_id in tag_ids:
+                user_tag = active.get((user.id, tag_id))
+
+                if tag_id in user_tags and user_tag is None:
+                    rows.append({'user_id': user.id, 'tag_id': tag_id,
+                                 'start': now})
+                    started = True
+
+                elif tag_id not in user_tags and user_tag is not None:
+                    user_tag.end_association()
+
+            if started:
+                # The INSERT bypasses the loaded collection.
+                db.session.expire(user, ['tags'])
+
+            invalidate_tag_snapshot(user.id)
+
+        if rows:
+            db.session.execute(UserTag.__table__.insert(), rows)
+
+            # The ORM does not see the INSERT, tell the caches about it.
+            for row in rows:
+                note_change(db.session, UserTag(**row))
+
+    @staticmethod
+    def by_tags(tags, mandatory=None):
+        """Return an OrderedDict of tag name -> active users with that tag.
+
+        The tags keep the order they are given in, and the users of each
+        tag are ordered by first name. Users must also have all tags in
+        mandatory. Everything is fetched with a single query.
+        """
+        return User._by_tags(tags, mandatory, UserTag.is_active == True)
+
+    @staticmethod
+    def by_tags_during(tags, start, end=None, mandatory=None):
+        """Return an OrderedDict of tag name -> users that had that tag
+        at some time between start and end.
+
+        Without end, return the users that had the tag at the time
+        start. Works like by_tags but on the history of the
+        associations, and mandatory tags must have been held in the
+        same period. Everything is fetched with a single query.
+        """
+        return User._by_tags(tags, mandatory,
+                             UserTag.was_active(start, end))
+
+    @staticmethod
+    def _by_tags(tags, mandatory, association_filter):
+        members = OrderedDict((tag, []) for tag in tags)
+
+        # Taken once, the registry may be reloaded while querying.
+        names = {tag_id: name
+                 for name, tag_id in tag_registry.ids_by_name(*tags).items()}
+
+        query = (db.session.query(UserTag.tag_id, User)
+                 .join(UserTag.user)
+                 .filter(UserTag.tag_id.in_(names), association_filter))
+
+        for tag in mandatory or []:
+            query = query.filter(User.tags.any(
+                UserTag.tag_id.in_(tag_registry.ids(tag)) &
+                association_filter))
+
+        # A user may have had a tag several times during a period.
+        query = query.distinct()
+
+        for tag_id, user in query.order_by(User.first_name):
+            members[names[tag_id]].append(user)
+
+        return members
+
+    @staticmethod
+    def tagged(tags, mandatory=None):
+        """Return query of users with any of tags and all of mandatory."""
+        query = User.query.filter(User.has_tag(*tags))
+        for tag in mandatory or []:
+            query = query.filter(User.has_tag(tag))
+
+        return query
+
+    @staticmethod
+    def in_batches(query, batch_size=500, after=0):
+        """Yield the users in query as lists of at most batch_size.
+
+        Users are fetched in id order, paging on the id, so only one
+        batch is loaded at a time however many users match. Only users
+        with an id greater than after are included.
+        """
+        last_id = after
+        while True:
+            batch = (query.filter(User.id > last_id)
+                     .order_by(User.id)
+                     .limit(batch_size)
+                     .all())
+            if not batch:
+                return
+
+            yield batch
+            last_id = batch[-1].id
+
     @staticmethod
     def authenticate(email, password):
         """Check email and password and return user if matching.
@@ -118,10 +409,19 @@ class User(UserMixin, db.Model):
         the email toghether with a matching password is enough to
         identify which user we want! No matching email and password ->
         no user.
+
+        Passwords hashed with a lower cost factor than the current one
+        are rehashed, see fernet.passwords.
         """
         user = User.query.filter_by(email=email).first()
 
         if user and user.verify_password(password):
+            if passwords.needs_rehash(user._password):
+                # Same password, so keep the timestamp and with it any
+                # pending reset links.
+                user._password = passwords.generate(password)
+                db.session.commit()
+
             return user
 
         return None
@@ -143,6 +443,82 @@ class Tag(db.Model):
         return self.name
 
 
+TagInfo = namedtuple('TagInfo', ['id', 'name'])
+
+
+class TagRegistry:
+    """In-process catalogue of all tags.
+
+    Tags are few and almost never change, so they are loaded once and
+    kept in process as TagInfo tuples. Lookups by name and id are then
+    dict lookups, and queries can filter on tag ids instead of joining
+    Tag. The catalogue is reloaded after a commit that changes a tag,
+    and after TAG_REGISTRY_MAX_AGE seconds to pick up changes made by
+    other processes.
+    """
+    Catalogue = namedtuple('Catalogue', ['tags', 'by_id', 'by_name',
+                                         'expires'])
+
+    def __init__(self):
+        self._catalogue = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        catalogue = self._catalogue
+        if catalogue is None or time.monotonic() > catalogue.expires:
+            with self._lock:
+                catalogue = self._catalogue
+                if catalogue is None or time.monotonic() > catalogue.expires:
+                    catalogue = self._catalogue = self._load()
+
+        return catalogue
+
+    def _load(self):
+        tags = tuple(TagInfo(*row) for row in
+                     db.session.query(Tag.id, Tag.name).order_by(Tag.name))
+
+        return self.Catalogue(
+            tags=tags,
+            by_id={tag.id: tag for tag in tags},
+            by_name={tag.name: tag for tag in tags},
+            expires=time.monotonic() + app.config['TAG_REGISTRY_MAX_AGE'])
+
+    def all(self):
+        """Return tuple of all tags, sorted by name."""
+        return self._get().tags
+
+    def get(self, tag_id):
+        """Return tag with id tag_id, or None."""
+        return self._get().by_id.get(tag_id)
+
+    def by_name(self, name):
+        """Return tag named name, or None."""
+        return self._get().by_name.get(name)
+
+    def ids_by_name(self, *names):
+        """Return dict of name -> id of the tags in names, unknown names
+        skipped.
+        """
+        by_name = self._get().by_name
+        return {name: by_name[name].id for name in names if name in by_name}
+
+    def ids(self, *names):
+        """Return list of ids of the tags in names, unknown names skipped."""
+        by_name = self._get().by_name
+        return [by_name[name].id for name in names if name in by_name]
+
+    def invalidate(self):
+        self._catalogue = None
+
+
+tag_registry = TagRegistry()
+
+
+@on_commit(Tag)
+def _invalidate_tag_registry(keys):
+    tag_registry.invalidate()
+
+
 class ScoreCollection(db.Model):
     """A collection of scores."""
     id = db.Column(db.Integer, primary_key=True)
@@ -160,3 +536,95 @@ class Score(db.Model):
     place = db.Column(db.String(50))
     comments = db.Column(db.Text())
     collection_id = db.Column(db.Integer, db.ForeignKey('score_collection.id'))
+
+
+class UploadedImage(db.Model):
+    """An image uploaded to teknologkoren.se, by content hash.
+
+    Used to not upload the same image again, see
+    teknologkoren_se.upload_image.
+    """
+    content_hash = db.Column(db.String(64), primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)
+    uploaded = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class MirroredItem(db.Model):
+    """A post or event on teknologkoren.se, as last seen by the mirror.
+
+    collection is 'posts' or 'events' and data the item's json. See
+    teknologkoren_se.sync_collection.
+    """
+    collection = db.Column(db.String(20), primary_key=True)
+    item_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    data = db.Column(db.Text, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_mirrored_item_collection_timestamp',
+                 'collection', 'timestamp'),
+        )
+
+
+class MirrorState(db.Model):
+    """When a mirrored collection was last synced, and its ETag then."""
+    collection = db.Column(db.String(20), primary_key=True)
+    etag = db.Column(db.String(200))
+    synced = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class BulkEmail(db.Model):
+    """An email sent to everyone with some tags, see fernet.bulk_email.
+
+    tags and mandatory are '+' separated tag names, like in the members
+    urls. sent counts the messages delivered to the mail server so far
+    and failed those it refused, the last of them to the user with id
+    last_user_id. job is the job sending it.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    tags = db.Column(db.String(500), nullable=False)
+    mandatory = db.Column(db.String(500))
+    sender_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    sender = db.relationship('User')
+    total = db.Column(db.Integer, nullable=False, default=0)
+    sent = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    last_user_id = db.Column(db.Integer, nullable=False, default=0)
+    job_id = db.Column(db.Integer, db.ForeignKey('job.id'))
+    job = db.relationship('Job')
+    created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished = db.Column(db.DateTime)
+
+    @property
+    def tag_list(self):
+        return self.tags.split('+')
+
+    @property
+    def mandatory_list(self):
+        return self.mandatory.split('+') if self.mandatory else None
+
+
+class Job(db.Model):
+    """A call of a task, run by a worker process, see fernet.jobs.
+
+    status is 'queued', 'running', 'done' or 'failed'. args and result
+    are json.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    task = db.Column(db.String(200), nullable=False)
+    args = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_after = db.Column(db.DateTime, nullable=False,
+                          default=datetime.utcnow)
+    created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started = db.Column(db.DateTime)
+    finished = db.Column(db.DateTime)
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index('ix_job_status_run_after', 'status', 'run_after'),
+        )
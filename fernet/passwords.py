@@ -0,0 +1,139 @@
+"""Password hashing, in a bounded pool of threads.
+
+bcrypt is slow on purpose, and a burst of logins (everyone logging in
+before rehearsal) would otherwise take every cpu from the rest of the
+site. Hashes are computed by at most PASSWORD_HASH_WORKERS threads
+(bcrypt releases the GIL, so they do run in parallel), with at most
+PASSWORD_HASH_QUEUE more waiting for them. When the queue is full,
+requests wait up to PASSWORD_HASH_QUEUE_TIMEOUT seconds for a place and
+then fail with 503 Service Unavailable instead of piling up.
+
+The cost factor is picked once per process: the highest one that
+hashes in at most PASSWORD_HASH_TARGET_TIME seconds on this machine,
+but never below PASSWORD_HASH_MIN_ROUNDS, the cost factor used before
+calibration, so calibration can only make hashes stronger. Setting BCRYPT_LOG_ROUNDS
+skips the calibration, and is needed for every process to use the
+same cost factor. Passwords hashed with a lower cost factor are rehashed
+when their user logs in, see User.authenticate.
+"""
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import ServiceUnavailable
+from fernet import app, bcrypt
+
+# bcrypt's own limit
+MAX_ROUNDS = 31
+
+# Stored instead of a hash for users without a password yet, e.g. new
+# members who are to set one with a reset link. Never a bcrypt hash, so
+# no password matches it.
+UNUSABLE = '!'
+
+_executor = ThreadPoolExecutor(
+        max_workers=app.config['PASSWORD_HASH_WORKERS'],
+        thread_name_prefix='passwords')
+
+# A place is taken for each hash running or waiting in _executor.
+_places = threading.BoundedSemaphore(app.config['PASSWORD_HASH_WORKERS'] +
+                                     app.config['PASSWORD_HASH_QUEUE'])
+
+_rounds = None
+_rounds_lock = threading.Lock()
+
+
+class Busy(ServiceUnavailable):
+    """Raised when too many passwords are waiting to be hashed."""
+    description = ('Too many people are logging in right now, please try '
+                   'again in a moment.')
+
+
+def calibrate(target, min_rounds):
+    """Return the highest cost factor that hashes in at most target seconds.
+
+    Every extra round doubles the time, so timing min_rounds is enough.
+    """
+    elapsed = min(_time_hash(min_rounds) for _ in range(3))
+    extra = math.floor(math.log2(target / elapsed)) if elapsed < target else 0
+
+    return min(min_rounds + extra, MAX_ROUNDS)
+
+
+def _time_hash(rounds):
+    start = time.perf_counter()
+    bcrypt.generate_password_hash('calibration', rounds)
+    return time.perf_counter() - start
+
+
+def rounds():
+    """Return the cost factor to hash with, calibrating it if needed."""
+    global _rounds
+
+    with _rounds_lock:
+        if _rounds is None:
+            _rounds = (app.config['BCRYPT_LOG_ROUNDS'] or
+                       calibrate(app.config['PASSWORD_HASH_TARGET_TIME'],
+                                 app.config['PASSWORD_HASH_MIN_ROUNDS']))
+            app.logger.info('Hashing passwords with cost factor %d', _rounds)
+
+    return _rounds
+
+
+@app.before_first_request
+def calibrate_on_startup():
+    """Calibrate before the first login has to wait for it."""
+    rounds()
+
+
+def run(func, *args):
+    """Run func(*args) in the pool and return its result, see module."""
+    if not _places.acquire(
+            timeout=app.config['PASSWORD_HASH_QUEUE_TIMEOUT']):
+        app.logger.warning('Too many passwords waiting to be hashed')
+        raise Busy()
+
+    try:
+        future = _executor.submit(func, *args)
+    except BaseException:
+        _places.release()
+        raise
+
+    future.add_done_callback(lambda _: _places.release())
+    return future.result()
+
+
+def generate(plaintext):
+    """Return a hash of plaintext."""
+    return run(bcrypt.generate_password_hash, plaintext, rounds())
+
+
+def check(pw_hash, plaintext):
+    """Return True if plaintext matches pw_hash, else False."""
+    return run(bcrypt.check_password_hash, pw_hash, plaintext)
+
+
+def usable(pw_hash):
+    """Return False if pw_hash is UNUSABLE (or missing), else True."""
+    if isinstance(pw_hash, bytes):
+        pw_hash = pw_hash.decode('utf-8')
+
+    return bool(pw_hash) and pw_hash != UNUSABLE
+
+
+def cost(pw_hash):
+    """Return the cost factor of pw_hash, e.g. 12 for '$2b$12$...'."""
+    if isinstance(pw_hash, bytes):
+        pw_hash = pw_hash.decode('utf-8')
+
+    return int(pw_hash.split('$')[2])
+
+
+def needs_rehash(pw_hash):
+    """Return True if pw_hash was made with a lower cost factor.
+
+    Processes may calibrate to different cost factors, and hashes are
+    never downgraded, so that two of them do not keep rehashing the
+    same password back and forth.
+    """
+    return cost(pw_hash) < rounds()
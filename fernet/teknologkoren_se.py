@@ -1,44 +1,195 @@
 import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote
 import pytz
 import requests
-from flask import flash
-from fernet import app
+from flask import flash, has_request_context
+from requests.adapters import HTTPAdapter
+from sqlalchemy.exc import IntegrityError
+from urllib3.util.retry import Retry
+from fernet import app, db, jobs
+from fernet.models import MirroredItem, MirrorState, UploadedImage
 
 API_URL = app.config['TEKNOLOGKORENSE_API_URL']
 AUTH = requests.auth.HTTPBasicAuth(
         app.config['TEKNOLOGKORENSE_API_USERNAME'],
         app.config['TEKNOLOGKORENSE_API_PASSWORD']
         )
+TIMEOUT = (app.config['TEKNOLOGKORENSE_API_CONNECT_TIMEOUT'],
+           app.config['TEKNOLOGKORENSE_API_READ_TIMEOUT'])
 
+# collections kept in a local mirror, see sync_collection
+MIRRORED = ('posts', 'events')
 
-def make_request(requests_func, url, data=None, files=None):
-    """Wrap a requests function.
 
-    Returns response if connection was successful and response is ok, flashes
-    an error and returns None otherwise.
+def make_session():
+    """Return a session with pooled keep-alive connections to the api.
+
+    Idempotent requests (GET, PUT, DELETE) are retried with exponential
+    backoff on connection errors and 502/503/504 responses. POST is
+    never retried, it could create duplicates.
     """
+    retry = Retry(total=app.config['TEKNOLOGKORENSE_API_RETRIES'],
+                  backoff_factor=app.config['TEKNOLOGKORENSE_API_BACKOFF'],
+                  status_forcelist=(502, 503, 504),
+                  raise_on_status=False)
+
+    adapter = HTTPAdapter(
+            pool_maxsize=app.config['TEKNOLOGKORENSE_API_POOL_SIZE'],
+            max_retries=retry)
+
+    session = requests.Session()
+    session.auth = AUTH
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+session = make_session()
+
+
+class CircuitBreaker:
+    """Stop calling the api for a while when it keeps failing.
+
+    While closed, requests go through and consecutive failures
+    (connection errors, timeouts and 5xx responses) are counted. After
+    threshold of them in a row the breaker opens and requests fail
+    immediately instead of waiting on a dead host. After reset_timeout
+    seconds it is half-open: a single request at a time is let through
+    as a probe, which closes the breaker if it succeeds and opens it
+    again if it fails.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        # when the breaker opened, monotonic and wall clock (for display)
+        self.opened = None
+        self.since = None
+        self.probe_started = None
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self):
+        """Return whether a request may be made now."""
+        with self.lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+
+            if state == self.HALF_OPEN:
+                # A probe that never reported back counts as failed.
+                now = time.monotonic()
+                if (self.probe_started is None or
+                        now - self.probe_started > self.reset_timeout):
+                    self.probe_started = now
+                    return True
+
+            return False
+
+    def release(self):
+        """Forget the current probe without counting its outcome, for
+        requests that ended for reasons of their own (see make_request).
+        """
+        with self.lock:
+            self.probe_started = None
+
+    def succeeded(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = self.since = self.probe_started = None
+
+    def failed(self):
+        with self.lock:
+            self.failures += 1
+            self.probe_started = None
+            if self.opened is not None or self.failures >= self.threshold:
+                self.opened = time.monotonic()
+                if self.since is None:
+                    self.since = datetime.datetime.utcnow()
+
+
+breaker = CircuitBreaker(app.config['TEKNOLOGKORENSE_API_BREAKER_THRESHOLD'],
+                         app.config['TEKNOLOGKORENSE_API_BREAKER_RESET'])
+
+
+def report_error(message):
+    """Flash message as an error, or log it outside of requests."""
+    if has_request_context():
+        flash(message, 'error')
+    else:
+        app.logger.warning(message)
+
+
+def make_request(method, url, data=None, files=None, headers=None,
+                 body=None, report=report_error, expected=()):
+    """Make a request to the api with the shared session.
+
+    data is sent as json, body (bytes or an iterable of them) as is.
+
+    Returns response if connection was successful and response is ok, or
+    its status is in expected (then the response is falsy). Otherwise
+    reports an error with report, flashing it by default, and returns
+    None. While the breaker is open, no request is made at all.
+    """
+    if not breaker.allow():
+        report('teknologkoren.se is not responding, try again in a while.')
+        return None
+
     try:
-        r = requests_func(url, json=data, files=files, auth=AUTH)
+        r = session.request(method, url, json=data, files=files, data=body,
+                            headers=headers, timeout=TIMEOUT)
     except requests.exceptions.ConnectionError:
-        flash('Failed to connect to teknologkoren.se.', 'error')
+        breaker.failed()
+        report('Failed to connect to teknologkoren.se.')
         return None
     except requests.exceptions.Timeout:
-        flash('Connection to teknologkoren.se timed out.', 'error')
+        breaker.failed()
+        report('Connection to teknologkoren.se timed out.')
         return None
-
-    if not r.ok:
+    except BaseException:
+        # Not an answer from the api, e.g. UploadTooLarge from body, so
+        # it neither opens nor closes the breaker. If this was the
+        # half-open probe, let another request be one.
+        breaker.release()
+        raise
+
+    if r.status_code >= 500:
+        breaker.failed()
+    else:
+        breaker.succeeded()
+
+    if not r.ok and r.status_code not in expected:
         if r.status_code == 404:
-            flash('Whatever you were trying access does not exist.', 'error')
+            report('Whatever you were trying access does not exist.')
             return None
 
         else:
-            flash('Something went wrong, try again or ask webmaster for help.',
-                  'error')
+            report('Something went wrong, try again or ask webmaster for '
+                   'help.')
 
             # log error
-            print(('API error: request = {}, url = {}, data = {}, files = {}'
+            print(('API error: method = {}, url = {}, data = {}, files = {}'
                    ', status_code = {}, response = {}'
-                   ).format(requests_func, url, data, files, r.status_code,
+                   ).format(method, url, data, files, r.status_code,
                             r.json()))
 
             return None
@@ -46,40 +197,205 @@ def make_request(requests_func, url, data=None, files=None):
     return r
 
 
-def make_get(url):
-    r = make_request(requests.get, url)
+def make_get(url, headers=None, report=report_error, expected=()):
+    r = make_request('GET', url, headers=headers, report=report,
+                     expected=expected)
 
     return r
 
 
 def make_post(url, data=None, files=None):
-    return make_request(requests.post, url, data, files)
+    return make_request('POST', url, data, files)
 
 
 def make_put(url, data=None, files=None):
-    return make_request(requests.put, url, data, files)
+    return make_request('PUT', url, data, files)
 
 
 def make_delete(url):
-    return make_request(requests.delete, url)
+    return make_request('DELETE', url)
 
 
-def get_all_posts():
-    return make_get("{}/posts".format(API_URL))
+def parse_timestamp(item):
+    """Return the (RFC 2822) timestamp of a post or event as naive utc."""
+    timestamp = parsedate_to_datetime(item['timestamp'])
+    if timestamp.tzinfo:
+        timestamp = timestamp.astimezone(pytz.utc).replace(tzinfo=None)
+    return timestamp
 
 
-def get_post(post_id):
-    return make_get("{}/posts/{}".format(API_URL, post_id))
+def mirror_item(collection, item):
+    """Store item, as returned by the api, in the mirror of collection."""
+    db.session.merge(MirroredItem(collection=collection, item_id=item['id'],
+                                  timestamp=parse_timestamp(item),
+                                  data=json.dumps(item, sort_keys=True)))
+    db.session.commit()
 
 
-def new_post(title, content_sv, content_en, readmore_sv, readmore_en,
-             published, image=None):
-    """Upload a new post.
+def refresh_item(collection, item_id, report=report_error):
+    """Fetch item with id item_id in collection into the mirror.
 
-    `image` is not the actual image, it is the filename returned by an
-    upload via `/api/images`.
+    An item that no longer exists is removed from the mirror. Errors
+    are reported with report, see make_request.
+
+    Returns True if successful, False otherwise.
     """
-    data = {
+    r = make_get("{}/{}/{}".format(API_URL, collection, item_id),
+                 report=report, expected=(404,))
+    if r is None:
+        return False
+
+    if r.status_code == 404:
+        unmirror_item(collection, item_id)
+    else:
+        mirror_item(collection, r.json())
+    return True
+
+
+def unmirror_item(collection, item_id):
+    """Remove item with id item_id from the mirror of collection."""
+    MirroredItem.query.filter_by(collection=collection,
+                                 item_id=item_id).delete()
+    db.session.commit()
+
+
+def sync_collection(collection):
+    """Update the local mirror of collection ('posts' or 'events').
+
+    The collection is fetched with If-None-Match, so nothing is
+    downloaded if it has not changed since the last sync. Otherwise
+    only the items that were added, changed or removed are written.
+
+    Returns True if successful, False otherwise.
+    """
+    state = MirrorState.query.get(collection)
+
+    headers = None
+    if state and state.etag:
+        headers = {'If-None-Match': state.etag}
+
+    r = make_get("{}/{}".format(API_URL, collection), headers)
+    if not r:
+        return False
+
+    if r.status_code != 304:
+        mirrored = {item.item_id: item for item in
+                    MirroredItem.query.filter_by(collection=collection)}
+        remote = {item['id']: item for item in r.json()}
+
+        for item_id, item in remote.items():
+            data = json.dumps(item, sort_keys=True)
+            old = mirrored.get(item_id)
+
+            if old is None:
+                db.session.add(MirroredItem(collection=collection,
+                                            item_id=item_id,
+                                            timestamp=parse_timestamp(item),
+                                            data=data))
+            elif old.data != data:
+                old.timestamp = parse_timestamp(item)
+                old.data = data
+
+        for item_id, old in mirrored.items():
+            if item_id not in remote:
+                db.session.delete(old)
+
+    if state is None:
+        state = MirrorState(collection=collection)
+        db.session.add(state)
+
+    state.synced = datetime.datetime.utcnow()
+    if r.status_code != 304:
+        state.etag = r.headers.get('ETag')
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another process synced at the same time.
+        db.session.rollback()
+        return False
+
+    return True
+
+
+def get_mirrored(collection):
+    """Return all mirrored items in collection, newest first.
+
+    The collection is synced first if it has never been. Returns None
+    if that failed.
+    """
+    if MirrorState.query.get(collection) is None:
+        sync_collection(collection)
+
+        # It may also have been synced by someone else meanwhile.
+        if MirrorState.query.get(collection) is None:
+            return None
+
+    items = (MirroredItem.query
+             .filter_by(collection=collection)
+             .order_by(MirroredItem.timestamp.desc()))
+
+    return [json.loads(item.data) for item in items]
+
+
+def get_mirrored_item(collection, item_id):
+    """Return the mirrored item if the breaker is not closed, else None.
+
+    Used by reads of single items to fall back to the mirror while the
+    api is unavailable.
+    """
+    if breaker.state == breaker.CLOSED:
+        return None
+
+    item = MirroredItem.query.get((collection, item_id))
+    return json.loads(item.data) if item else None
+
+
+def sync_mirror():
+    """Sync all mirrored collections, see sync_collection."""
+    for collection in MIRRORED:
+        sync_collection(collection)
+
+
+@app.before_first_request
+def start_mirror_worker():
+    """Sync the mirror every TEKNOLOGKORENSE_MIRROR_INTERVAL seconds.
+
+    Runs in a daemon thread in each process serving requests, unless
+    the interval is 0.
+    """
+    interval = app.config['TEKNOLOGKORENSE_MIRROR_INTERVAL']
+    if not interval:
+        return
+
+    def work():
+        while True:
+            with app.app_context():
+                try:
+                    sync_mirror()
+                except Exception:
+                    app.logger.exception('Failed to sync mirror')
+                finally:
+                    db.session.remove()
+
+            time.sleep(interval)
+
+    threading.Thread(target=work, name='teknologkoren-se-mirror',
+                     daemon=True).start()
+
+
+def get_all_posts():
+    """Return all posts, newest first, from the mirror.
+
+    Returns None if the mirror is empty and syncing it failed.
+    """
+    return get_mirrored('posts')
+
+
+def post_data(title, content_sv, content_en, readmore_sv, readmore_en,
+              published, image):
+    """Return the json to send for a new or updated post."""
+    return {
         'title': title,
         'content_sv': content_sv,
         'content_en': content_en or None,
@@ -88,7 +404,35 @@ def new_post(title, content_sv, content_en, readmore_sv, readmore_en,
         'published': published,
         'image': image,
     }
-    return make_post("{}/posts".format(API_URL), data)
+
+
+def get_post(post_id):
+    """Get a post.
+
+    Returns the post, or None if the request failed. While the breaker
+    is open, the mirrored post is returned if there is one.
+    """
+    r = make_get("{}/posts/{}".format(API_URL, post_id))
+
+    if not r:
+        return get_mirrored_item('posts', post_id)
+
+    return r.json()
+
+
+def new_post(title, content_sv, content_en, readmore_sv, readmore_en,
+             published, image=None):
+    """Upload a new post.
+
+    `image` is not the actual image, it is the filename returned by an
+    upload via `/api/images`.
+    """
+    data = post_data(title, content_sv, content_en, readmore_sv, readmore_en,
+                     published, image)
+    r = make_post("{}/posts".format(API_URL), data)
+    if r:
+        mirror_item('posts', r.json())
+    return r
 
 
 def update_post(post_id, title, content_sv, content_en, readmore_sv,
@@ -98,47 +442,77 @@ def update_post(post_id, title, content_sv, content_en, readmore_sv,
     `image` is not the actual image, it is the filename returned by an
     upload via `/api/images`.
     """
-    data = {
+    data = post_data(title, content_sv, content_en, readmore_sv, readmore_en,
+                     published, image)
+    r = make_put("{}/posts/{}".format(API_URL, post_id), data)
+    if r:
+        mirror_item('posts', r.json())
+    return r
+
+
+def delete_post(post_id):
+    r = make_delete("{}/posts/{}".format(API_URL, post_id))
+    if r:
+        unmirror_item('posts', post_id)
+    return r
+
+
+def get_all_events():
+    """Return all events, newest first, from the mirror.
+
+    Returns None if the mirror is empty and syncing it failed.
+    """
+    return get_mirrored('events')
+
+
+def event_data(title, content_sv, content_en, readmore_sv, readmore_en,
+               published, start_time, location, image):
+    """Return the json to send for a new or updated event."""
+    # User enters local time, convert to utc
+    tz = pytz.timezone('Europe/Stockholm')
+    utc_start_time = tz.localize(start_time, is_dst=None).astimezone(pytz.utc)
+    utc_start_time_str = utc_start_time.strftime('%Y-%m-%dT%H:%M')
+
+    return {
         'title': title,
         'content_sv': content_sv,
         'content_en': content_en or None,
         'readmore_sv': readmore_sv or None,
         'readmore_en': readmore_en or None,
         'published': published,
+        'start_time': utc_start_time_str,
+        'location': location,
         'image': image,
     }
-    return make_put("{}/posts/{}".format(API_URL, post_id), data)
 
 
-def delete_post(post_id):
-    return make_delete("{}/posts/{}".format(API_URL, post_id))
+def localize_event(d):
+    """Convert the (utc, iso-format) start time of event d to datetime."""
+    tz = pytz.timezone('Europe/Stockholm')
+    utc_start_time = datetime.datetime.strptime(d['start_time'],
+                                                '%Y-%m-%dT%H:%M')
+    local_time = pytz.utc.localize(utc_start_time, is_dst=None).astimezone(tz)
 
+    d['start_time'] = local_time
 
-def get_all_events():
-    return make_get("{}/events".format(API_URL))
+    return d
 
 
 def get_event(event_id):
     """Get an event.
 
-    Returns modified response, converting iso-format date string to
-    datetime.
+    Returns the event, converting iso-format date string to datetime,
+    or None if the request failed. While the breaker is open, the
+    mirrored event is returned if there is one.
     """
     r = make_get("{}/events/{}".format(API_URL, event_id))
 
-    if not r:
-        return r
-
-    d = r.json()
-
-    tz = pytz.timezone('Europe/Stockholm')
-    utc_start_time = datetime.datetime.strptime(d['start_time'],
-                                                '%Y-%m-%dT%H:%M')
-    local_time = pytz.utc.localize(utc_start_time, is_dst=None).astimezone(tz)
+    d = r.json() if r else get_mirrored_item('events', event_id)
 
-    d['start_time'] = local_time
+    if not d:
+        return None
 
-    return d
+    return localize_event(d)
 
 
 def new_event(title, content_sv, content_en, readmore_sv, readmore_en,
@@ -148,23 +522,12 @@ def new_event(title, content_sv, content_en, readmore_sv, readmore_en,
     `image` is not the actual image, it is the filename returned by an
     upload via `/api/images`.
     """
-    # User enters local time, convert to utc
-    tz = pytz.timezone('Europe/Stockholm')
-    utc_start_time = tz.localize(start_time, is_dst=None).astimezone(pytz.utc)
-    utc_start_time_str = utc_start_time.strftime('%Y-%m-%dT%H:%M')
-
-    data = {
-        'title': title,
-        'content_sv': content_sv,
-        'content_en': content_en or None,
-        'readmore_sv': readmore_sv or None,
-        'readmore_en': readmore_en or None,
-        'published': published,
-        'start_time': utc_start_time_str,
-        'location': location,
-        'image': image,
-    }
-    return make_post("{}/events".format(API_URL), data)
+    data = event_data(title, content_sv, content_en, readmore_sv, readmore_en,
+                      published, start_time, location, image)
+    r = make_post("{}/events".format(API_URL), data)
+    if r:
+        mirror_item('events', r.json())
+    return r
 
 
 def update_event(event_id, title, content_sv, content_en, readmore_sv,
@@ -174,32 +537,169 @@ def update_event(event_id, title, content_sv, content_en, readmore_sv,
     `image` is not the actual image, it is the filename returned by an
     upload via `/api/images`.
     """
-    # User enters local time, convert to utc
-    tz = pytz.timezone('Europe/Stockholm')
-    utc_start_time = tz.localize(start_time, is_dst=None).astimezone(pytz.utc)
-    utc_start_time_str = utc_start_time.strftime('%Y-%m-%dT%H:%M')
-
-    data = {
-        'title': title,
-        'content_sv': content_sv,
-        'content_en': content_en or None,
-        'readmore_sv': readmore_sv or None,
-        'readmore_en': readmore_en or None,
-        'published': published,
-        'start_time': utc_start_time_str,
-        'location': location,
-        'image': image,
-    }
-    return make_put("{}/events/{}".format(API_URL, event_id), data)
+    data = event_data(title, content_sv, content_en, readmore_sv, readmore_en,
+                      published, start_time, location, image)
+    r = make_put("{}/events/{}".format(API_URL, event_id), data)
+    if r:
+        mirror_item('events', r.json())
+    return r
 
 
 def delete_event(event_id):
-    return make_delete("{}/events/{}".format(API_URL, event_id))
+    r = make_delete("{}/events/{}".format(API_URL, event_id))
+    if r:
+        unmirror_item('events', event_id)
+    return r
+
+
+class UploadTooLarge(Exception):
+    """Raised by StreamedFile when reading more than its max_size."""
+
+
+class StreamedFile:
+    """A multipart/form-data body with one file, streamed from a stream.
+
+    The file is read and sent in chunks as the body is iterated, so
+    memory use stays bounded whatever the size of the file. If the
+    stream is seekable the size is known beforehand and the body has a
+    length, so it is sent with a Content-Length header rather than
+    chunked. Raises UploadTooLarge as soon as more than max_size bytes
+    have been read. The sha256 of the file is computed as it is sent.
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, name, filename, stream, content_type, max_size):
+        boundary = uuid.uuid4().hex
+        # Escape the filename the same way browsers do.
+        filename = (filename.replace('\\', '\\\\').replace('"', '%22')
+                    .replace('\r', '%0D').replace('\n', '%0A'))
+
+        self.head = ('--{}\r\n'
+                     'Content-Disposition: form-data; name="{}"; '
+                     'filename="{}"\r\n'
+                     'Content-Type: {}\r\n\r\n'
+                     ).format(boundary, name, filename,
+                              content_type or 'application/octet-stream'
+                              ).encode('utf-8')
+        self.tail = '\r\n--{}--\r\n'.format(boundary).encode('utf-8')
+        self.content_type = 'multipart/form-data; boundary=' + boundary
+
+        self.stream = stream
+        self.max_size = max_size
+        self.sha256 = hashlib.sha256()
+
+        try:
+            position = stream.tell()
+            self.size = stream.seek(0, os.SEEK_END) - position
+            stream.seek(position)
+        except (AttributeError, OSError):
+            self.size = None
+
+    def __len__(self):
+        return len(self.head) + self.size + len(self.tail)
+
+    def __iter__(self):
+        yield self.head
+
+        read = 0
+        while True:
+            chunk = self.stream.read(self.chunk_size)
+            if not chunk:
+                break
+
+            read += len(chunk)
+            if read > self.max_size:
+                raise UploadTooLarge()
+
+            self.sha256.update(chunk)
+            yield chunk
+
+        yield self.tail
+
+
+def content_hash(stream, chunk_size=StreamedFile.chunk_size):
+    """Return sha256 hex digest of the rest of seekable stream.
+
+    The stream is left at the position it had.
+    """
+    position = stream.tell()
+    sha256 = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        sha256.update(chunk)
+    stream.seek(position)
+
+    return sha256.hexdigest()
+
+
+def image_exists(filename):
+    """Return True if teknologkoren.se has the uploaded image filename.
+
+    Asks with a HEAD request. The UploadedImage of an image that is gone
+    is removed. Returns False also if it could not be told, so that the
+    image is uploaded rather than possibly lost.
+    """
+    r = make_request('HEAD', "{}/images/{}".format(API_URL, quote(filename)),
+                     report=app.logger.warning, expected=(404,))
+    if r is None:
+        return False
+
+    if r.status_code == 404:
+        UploadedImage.query.filter_by(filename=filename).delete()
+        db.session.commit()
+        return False
+
+    return True
 
 
 def upload_image(image):
-    files = {'image': (image.filename, image.read())}
-    return make_post("{}/images".format(API_URL), files=files)
+    """Upload image, a FileStorage, to teknologkoren.se.
+
+    Returns the filename of the image on teknologkoren.se, or None if
+    the upload failed.
+
+    The sha256 of every uploaded image is stored along with its remote
+    filename. If an image with the same content has been uploaded
+    before, and teknologkoren.se still has it, its filename is returned
+    without uploading anything.
+
+    The image is streamed from its stream instead of being read into
+    memory. Images larger than TEKNOLOGKORENSE_API_MAX_UPLOAD bytes are
+    refused with a flashed error.
+    """
+    max_size = app.config['TEKNOLOGKORENSE_API_MAX_UPLOAD']
+    too_large = 'The image is too large, the maximum size is {} MB.'.format(
+            max_size // (1024 * 1024))
+
+    body = StreamedFile('image', image.filename, image.stream,
+                        image.mimetype, max_size)
+
+    if body.size is not None:
+        if body.size > max_size:
+            flash(too_large, 'error')
+            return None
+
+        uploaded = UploadedImage.query.get(content_hash(image.stream))
+        if uploaded and image_exists(uploaded.filename):
+            return uploaded.filename
+
+    try:
+        r = make_request('POST', "{}/images".format(API_URL),
+                         body=body if body.size is not None else iter(body),
+                         headers={'Content-Type': body.content_type})
+    except UploadTooLarge:
+        flash(too_large, 'error')
+        return None
+
+    if not r:
+        return None
+
+    filename = r.json()['filename']
+
+    db.session.merge(UploadedImage(content_hash=body.sha256.hexdigest(),
+                                   filename=filename))
+    db.session.commit()
+
+    return filename
 
 
 def get_all_contacts():
@@ -224,3 +724,20 @@ def new_contact(title, first_name, last_name, email, phone, weight):
 
 def delete_contact(contact_id):
     return make_delete("{}/contact/{}".format(API_URL, contact_id))
+
+
+CONTACT_FIELDS = ('title', 'first_name', 'last_name', 'email', 'phone',
+                  'weight')
+
+
+@jobs.task
+def update_contacts(contacts):
+    """Job syncing contacts, see teknologkoren_se_async.sync_contacts."""
+    # Imported here, as it builds on this module.
+    from fernet import teknologkoren_se_async
+
+    if not teknologkoren_se_async.run(
+            teknologkoren_se_async.sync_contacts(contacts))[0]:
+        raise jobs.TaskFailed('Failed to update contacts.')
+
+    return len(contacts)
@@ -0,0 +1,401 @@
+"""Asyncio variant of the teknologkoren_se client.
+
+Has the same functions as teknologkoren_se, as coroutines. They share
+one aiohttp session with pooled keep-alive connections, and at most
+TEKNOLOGKORENSE_API_CONCURRENCY requests are in flight at the same
+time. The session lives on an event loop in a background thread, so
+synchronous views can run a batch of calls concurrently with run():
+
+    posts, event, contacts = teknologkoren_se_async.run(
+            get_all_posts(), get_event(event_id), get_all_contacts())
+
+Errors are flashed in the calling request like in teknologkoren_se, and
+the circuit breaker is shared with it. Writes go through to the local
+mirror. Unlike teknologkoren_se.get_all_posts and get_all_events, which
+read the mirror, the ones here always ask the api.
+
+Bulk operations, like syncing the contacts, are built on it too.
+"""
+import asyncio
+import atexit
+import contextvars
+import json
+import threading
+import aiohttp
+from fernet import app
+from fernet.teknologkoren_se import (API_URL, CONTACT_FIELDS, breaker,
+                                     event_data, get_mirrored_item,
+                                     localize_event, mirror_item,
+                                     parse_timestamp, post_data,
+                                     report_error, unmirror_item)
+
+_loop = None
+_loop_lock = threading.Lock()
+
+# Only used from the loop's thread, created there by client().
+_session = None
+_semaphore = None
+
+# Error messages of the current run() batch, flashed once it is done.
+_errors = contextvars.ContextVar('errors', default=None)
+
+
+class Response:
+    """An api response, with the body already read.
+
+    Like requests' Response it is falsy unless ok, and has json().
+    """
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def __bool__(self):
+        return self.ok
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+
+def get_loop():
+    """Return the client's event loop, starting it if needed."""
+    global _loop
+
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever,
+                             name='teknologkoren-se-async',
+                             daemon=True).start()
+            _loop = loop
+
+    return _loop
+
+
+@atexit.register
+def close():
+    """Close the shared session, if any, and stop the loop."""
+    if _loop is None:
+        return
+
+    if _session is not None:
+        future = asyncio.run_coroutine_threadsafe(_session.close(), _loop)
+        future.result(timeout=5)
+
+    _loop.call_soon_threadsafe(_loop.stop)
+
+
+def client():
+    """Return the shared aiohttp session, see module docstring."""
+    global _session, _semaphore
+
+    if _session is None:
+        _session = aiohttp.ClientSession(
+                auth=aiohttp.BasicAuth(
+                    app.config['TEKNOLOGKORENSE_API_USERNAME'],
+                    app.config['TEKNOLOGKORENSE_API_PASSWORD']),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=app.config[
+                        'TEKNOLOGKORENSE_API_CONNECT_TIMEOUT'],
+                    sock_read=app.config['TEKNOLOGKORENSE_API_READ_TIMEOUT']),
+                connector=aiohttp.TCPConnector(
+                    limit=app.config['TEKNOLOGKORENSE_API_POOL_SIZE']))
+        _semaphore = asyncio.Semaphore(
+                app.config['TEKNOLOGKORENSE_API_CONCURRENCY'])
+
+    return _session
+
+
+def report(message):
+    """Have message flashed when the batch is done, see run()."""
+    errors = _errors.get()
+    if errors is None:
+        app.logger.warning(message)
+    else:
+        errors.append(message)
+
+
+def run(*calls):
+    """Run coroutines calls concurrently and return their results in order.
+
+    Blocks until all of them are done, then flashes their errors (each
+    message once).
+    """
+    async def batch():
+        errors = []
+        _errors.set(errors)
+        return await asyncio.gather(*calls), errors
+
+    future = asyncio.run_coroutine_threadsafe(batch(), get_loop())
+    results, errors = future.result()
+
+    for message in dict.fromkeys(errors):
+        report_error(message)
+
+    return results
+
+
+async def in_app_context(func, *args):
+    """Run blocking func, e.g. a database write, in an app context.
+
+    It runs in the loop's default executor, not to block other calls.
+    """
+    def call():
+        with app.app_context():
+            return func(*args)
+
+    return await asyncio.get_running_loop().run_in_executor(None, call)
+
+
+async def make_request(method, url, data=None, headers=None, report=report,
+                       expected=()):
+    """Make a request to the api with the shared session.
+
+    data is sent as json. Idempotent requests are retried like in
+    teknologkoren_se.make_session.
+
+    Returns response if connection was successful and response is ok, or
+    its status is in expected (then the response is falsy). Otherwise
+    reports an error with report, flashed after the batch by default,
+    and returns None. While the breaker is open, no request is made.
+    """
+    if not breaker.allow():
+        report('teknologkoren.se is not responding, try again in a while.')
+        return None
+
+    session = client()
+    retries = 0 if method == 'POST' else app.config[
+            'TEKNOLOGKORENSE_API_RETRIES']
+    backoff = app.config['TEKNOLOGKORENSE_API_BACKOFF']
+
+    try:
+        async with _semaphore:
+            for attempt in range(retries + 1):
+                if attempt:
+                    await asyncio.sleep(backoff * 2 ** (attempt - 1))
+
+                try:
+                    async with session.request(method, url, json=data,
+                                               headers=headers) as resp:
+                        r = Response(resp.status, resp.headers,
+                                     await resp.read())
+                except asyncio.TimeoutError:
+                    r = None
+                    error = 'Connection to teknologkoren.se timed out.'
+                    continue
+                except aiohttp.ClientConnectionError:
+                    r, error = None, 'Failed to connect to teknologkoren.se.'
+                    continue
+
+                if r.status_code not in (502, 503, 504):
+                    break
+    except BaseException:
+        # Not an answer from the api, e.g. the batch was cancelled, see
+        # teknologkoren_se.make_request.
+        breaker.release()
+        raise
+
+    if r is None:
+        breaker.failed()
+        report(error)
+        return None
+
+    if r.status_code >= 500:
+        breaker.failed()
+    else:
+        breaker.succeeded()
+
+    if not r.ok and r.status_code not in expected:
+        if r.status_code == 404:
+            report('Whatever you were trying access does not exist.')
+        else:
+            report('Something went wrong, try again or ask webmaster for '
+                   'help.')
+            app.logger.error('API error: method = %s, url = %s, data = %s, '
+                             'status_code = %s, response = %s', method, url,
+                             data, r.status_code, r.content)
+        return None
+
+    return r
+
+
+async def make_get(url, headers=None, report=report, expected=()):
+    return await make_request('GET', url, headers=headers, report=report,
+                              expected=expected)
+
+
+async def make_post(url, data=None):
+    return await make_request('POST', url, data)
+
+
+async def make_put(url, data=None):
+    return await make_request('PUT', url, data)
+
+
+async def make_delete(url):
+    return await make_request('DELETE', url)
+
+
+async def get_collection(collection):
+    """Return all items in collection, newest first, or None."""
+    r = await make_get("{}/{}".format(API_URL, collection))
+
+    if not r:
+        return None
+
+    return sorted(r.json(), key=parse_timestamp, reverse=True)
+
+
+async def get_all_posts():
+    """Return all posts, newest first, or None if the request failed."""
+    return await get_collection('posts')
+
+
+async def get_post(post_id):
+    """Get a post, see teknologkoren_se.get_post."""
+    r = await make_get("{}/posts/{}".format(API_URL, post_id))
+
+    if not r:
+        return await in_app_context(get_mirrored_item, 'posts', post_id)
+
+    return r.json()
+
+
+async def new_post(title, content_sv, content_en, readmore_sv, readmore_en,
+                   published, image=None):
+    """Upload a new post, see teknologkoren_se.new_post."""
+    data = post_data(title, content_sv, content_en, readmore_sv, readmore_en,
+                     published, image)
+    r = await make_post("{}/posts".format(API_URL), data)
+    if r:
+        await in_app_context(mirror_item, 'posts', r.json())
+    return r
+
+
+async def update_post(post_id, title, content_sv, content_en, readmore_sv,
+                      readmore_en, published, image=None):
+    """Update a post, see teknologkoren_se.update_post."""
+    data = post_data(title, content_sv, content_en, readmore_sv, readmore_en,
+                     published, image)
+    r = await make_put("{}/posts/{}".format(API_URL, post_id), data)
+    if r:
+        await in_app_context(mirror_item, 'posts', r.json())
+    return r
+
+
+async def delete_post(post_id):
+    r = await make_delete("{}/posts/{}".format(API_URL, post_id))
+    if r:
+        await in_app_context(unmirror_item, 'posts', post_id)
+    return r
+
+
+async def get_all_events():
+    """Return all events, newest first, or None if the request failed."""
+    return await get_collection('events')
+
+
+async def get_event(event_id):
+    """Get an event, see teknologkoren_se.get_event."""
+    r = await make_get("{}/events/{}".format(API_URL, event_id))
+
+    if r:
+        d = r.json()
+    else:
+        d = await in_app_context(get_mirrored_item, 'events', event_id)
+
+    if not d:
+        return None
+
+    return localize_event(d)
+
+
+async def new_event(title, content_sv, content_en, readmore_sv, readmore_en,
+                    published, start_time, location, image=None):
+    """Upload a new event, see teknologkoren_se.new_event."""
+    data = event_data(title, content_sv, content_en, readmore_sv,
+                      readmore_en, published, start_time, location, image)
+    r = await make_post("{}/events".format(API_URL), data)
+    if r:
+        await in_app_context(mirror_item, 'events', r.json())
+    return r
+
+
+async def update_event(event_id, title, content_sv, content_en, readmore_sv,
+                       readmore_en, published, start_time, location,
+                       image=None):
+    """Update an event, see teknologkoren_se.update_event."""
+    data = event_data(title, content_sv, content_en, readmore_sv,
+                      readmore_en, published, start_time, location, image)
+    r = await make_put("{}/events/{}".format(API_URL, event_id), data)
+    if r:
+        await in_app_context(mirror_item, 'events', r.json())
+    return r
+
+
+async def delete_event(event_id):
+    r = await make_delete("{}/events/{}".format(API_URL, event_id))
+    if r:
+        await in_app_context(unmirror_item, 'events', event_id)
+    return r
+
+
+async def get_all_contacts():
+    return await make_get("{}/contact".format(API_URL))
+
+
+async def get_contact(contact_id):
+    return await make_get("{}/contact/{}".format(API_URL, contact_id))
+
+
+async def new_contact(title, first_name, last_name, email, phone, weight):
+    data = {
+        'title': title,
+        'first_name': first_name,
+        'last_name': last_name,
+        'email': email,
+        'phone': phone,
+        'weight': weight,
+    }
+    return await make_post("{}/contact".format(API_URL), data)
+
+
+async def delete_contact(contact_id):
+    return await make_delete("{}/contact/{}".format(API_URL, contact_id))
+
+
+async def sync_contacts(contacts):
+    """Make the contacts on teknologkoren.se equal to contacts.
+
+    contacts is a list of dicts with the arguments of new_contact.
+    Only the difference is sent: contacts that are missing are created
+    and contacts that are no longer wanted are deleted, concurrently.
+    Deletes are only made once all creates have succeeded, so a failure
+    never leaves the site with fewer contacts than before.
+
+    Returns True if successful, False otherwise.
+    """
+    r = await get_all_contacts()
+    if not r:
+        return False
+
+    def key(contact):
+        return tuple(contact[field] for field in CONTACT_FIELDS)
+
+    remote = {key(contact): contact['id'] for contact in r.json()}
+    wanted = {key(contact) for contact in contacts}
+
+    # The key is also the arguments of new_contact, in order.
+    created = await asyncio.gather(*(new_contact(*k) for k in wanted
+                                     if k not in remote))
+    if not all(created):
+        return False
+
+    deleted = await asyncio.gather(*(delete_contact(contact_id)
+                                     for k, contact_id in remote.items()
+                                     if k not in wanted))
+    return all(deleted)
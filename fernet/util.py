@@ -1,6 +1,3 @@
-import ssl
-import smtplib
-import threading
 from email.message import EmailMessage
 from functools import wraps
 from urllib.parse import urlparse, urljoin
@@ -9,6 +6,7 @@ from flask_login import current_user
 from itsdangerous import URLSafeTimedSerializer
 from werkzeug.routing import BaseConverter
 from fernet import app
+from fernet.mail import mail_queue
 
 
 ts = URLSafeTimedSerializer(app.config["SECRET_KEY"])
@@ -39,8 +37,20 @@ def paginate(content, page, page_size):
     return pagination
 
 
+def make_email(toaddr, subject, body):
+    """Return an EmailMessage from us to toaddr."""
+    msg = EmailMessage()
+    msg.set_content(body)
+
+    msg['Subject'] = subject
+    msg['From'] = app.config['SMTP_SENDADDR']
+    msg['To'] = toaddr
+
+    return msg
+
+
 def send_email(toaddr, subject, body):
-    """Send an email with SMTP & STARTTLS.
+    """Queue an email to be sent with SMTP & STARTTLS, see fernet.mail.
 
     Uses the best security defaults according to the python documentation at
     the time of writing:
@@ -50,28 +60,13 @@ def send_email(toaddr, subject, body):
     certificates, enable certificate validation and hostname checking, and try
     to choose reasonably secure protocol and cipher settings."
     """
+    msg = make_email(toaddr, subject, body)
 
-    msg = EmailMessage()
-    msg.set_content(body)
-
-    msg['Subject'] = subject
-    msg['From'] = app.config['SMTP_SENDADDR']
-    msg['To'] = toaddr
-
-    def thread_func():
-        if app.debug:
-            print(msg)
-            return
-
-        with smtplib.SMTP(app.config['SMTP_MAILSERVER'],
-                          port=app.config['SMTP_STARTTLS_PORT']) as smtp:
-            context = ssl.create_default_context()
-            smtp.starttls(context=context)
-            smtp.login(app.config['SMTP_USERNAME'], app.config['SMTP_PASSWORD'])
-            smtp.send_message(msg)
+    if app.debug:
+        print(msg)
+        return
 
-    thread = threading.Thread(target=thread_func)
-    thread.start()
+    mail_queue.put(msg)
 
 
 def url_for_other_page(page):
@@ -1,11 +1,11 @@
-from email.utils import parsedate_to_datetime
+import json
 from flask import (Blueprint, render_template, redirect, url_for, request,
-                   flash)
-from flask_login import login_required
+                   flash, jsonify)
+from flask_login import current_user, login_required
 from werkzeug.datastructures import CombinedMultiDict
-from fernet import app, db, forms, teknologkoren_se
+from fernet import app, bulk_email, db, forms, jobs, teknologkoren_se
 from fernet.views.auth import verify_email
-from fernet.models import User, Tag
+from fernet.models import BulkEmail, Job, User, tag_registry
 from fernet.util import tag_required
 
 mod = Blueprint('admin', __name__, url_prefix='/admin')
@@ -27,7 +27,8 @@ def before_request():
 @tag_required('Webmaster', 'PRoletär')
 def admin():
     """Show administration page."""
-    return render_template('admin/admin.html')
+    return render_template('admin/admin.html',
+                           breaker=teknologkoren_se.breaker)
 
 
 @mod.route('/edit-user/<int:id>/', methods=['GET', 'POST'])
@@ -40,7 +41,7 @@ def full_edit_user(id):
     """
     user = User.query.get_or_404(id)
 
-    tags = Tag.query.order_by(Tag.name).all()
+    tags = tag_registry.all()
     form = forms.TagForm.extend_form(forms.FullEditUserForm, tags, user)
 
     form = form(user)
@@ -73,7 +74,7 @@ def full_edit_user(id):
 @tag_required('Webmaster')
 def adduser():
     """Add a user."""
-    tags = Tag.query.order_by(Tag.name).all()
+    tags = tag_registry.all()
     Form = forms.TagForm.extend_form(forms.AddUserForm, tags)
 
     form = Form()
@@ -83,6 +84,7 @@ def adduser():
                     first_name=form.first_name.data,
                     last_name=form.last_name.data,
                     phone=form.phone.data)
+        db.session.add(user)
 
         forms.TagForm.set_user_tags(form, user)
 
@@ -105,13 +107,7 @@ def adduser():
 @tag_required('Webmaster', 'PRoletär')
 def view_posts():
     """Show links to all post's edit mode."""
-    r = teknologkoren_se.get_all_posts()
-    if r:
-        posts = r.json()
-        posts.sort(key=lambda x: parsedate_to_datetime(x['timestamp']),
-                   reverse=True)
-    else:
-        posts = {}
+    posts = teknologkoren_se.get_all_posts() or []
 
     return render_template('admin/view-posts.html', posts=posts)
 
@@ -120,13 +116,7 @@ def view_posts():
 @tag_required('Webmaster', 'PRoletär')
 def view_events():
     """Show links to all event's edit mode."""
-    r = teknologkoren_se.get_all_events()
-    if r:
-        events = r.json()
-        events.sort(key=lambda x: parsedate_to_datetime(x['timestamp']),
-                    reverse=True)
-    else:
-        events = {}
+    events = teknologkoren_se.get_all_events() or []
 
     return render_template('admin/view-events.html', events=events)
 
@@ -139,14 +129,10 @@ def new_post():
 
     if form.validate_on_submit():
         if form.upload.data:
-            r = teknologkoren_se.upload_image(form.upload.data)
-            if r:
-                upload = r.json()
-            else:
+            image = teknologkoren_se.upload_image(form.upload.data)
+            if not image:
                 return render_template('admin/edit-post.html', form=form)
 
-            image = upload['filename']
-
         else:
             image = None
 
@@ -180,13 +166,11 @@ def new_post():
 @tag_required('Webmaster', 'PRoletär')
 def edit_post(post_id, slug=None):
     """Edit an existing post."""
-    r = teknologkoren_se.get_post(post_id)
+    post = teknologkoren_se.get_post(post_id)
 
-    if not r:
+    if not post:
         return redirect(url_for('.view_posts'))
 
-    post = r.json()
-
     if slug != post['slug']:
         return redirect(url_for('.edit_post',
                                 post_id=post['id'],
@@ -197,13 +181,9 @@ def edit_post(post_id, slug=None):
 
     if form.validate_on_submit():
         if form.upload.data:
-            r = teknologkoren_se.upload_image(form.upload.data)
-            if r:
-                upload = r.json()
-            else:
+            image = teknologkoren_se.upload_image(form.upload.data)
+            if not image:
                 return render_template('admin/edit-post.html', form=form)
-
-            image = upload['filename']
         else:
             image = post['image']
 
@@ -248,13 +228,9 @@ def new_event():
 
     if form.validate_on_submit():
         if form.upload.data:
-            r = teknologkoren_se.upload_image(form.upload.data)
-            if r:
-                upload = r.json()
-            else:
+            image = teknologkoren_se.upload_image(form.upload.data)
+            if not image:
                 return render_template('admin/edit-post.html', form=form)
-
-            image = upload['filename']
         else:
             image = None
 
@@ -292,6 +268,9 @@ def edit_event(event_id, slug=None):
     """Edit an existing post."""
     event = teknologkoren_se.get_event(event_id)
 
+    if not event:
+        return redirect(url_for('.view_events'))
+
     if slug != event['slug']:
         return redirect(url_for('.edit_event',
                                 event_id=event['id'],
@@ -303,13 +282,9 @@ def edit_event(event_id, slug=None):
 
     if form.validate_on_submit():
         if form.upload.data:
-            r = teknologkoren_se.upload_image(form.upload.data)
-            if r:
-                upload = r.json()
-            else:
+            image = teknologkoren_se.upload_image(form.upload.data)
+            if not image:
                 return render_template('admin/edit-post.html', form=form)
-
-            image = upload['filename']
         else:
             image = event['image']
 
@@ -362,40 +337,96 @@ def update_contacts():
                 ('Qlubbmästare', 'qm@teknologkoren.se', 6),
                 ]
 
+        officers = User.by_tags([tag for tag, _, _ in tags])
+
         new_contacts = []
-        for tag in tags:
-            user = User.query.filter(User.has_tag(tag[0])).first()
+        for tag, email, weight in tags:
+            if not officers[tag]:
+                continue
+
+            user = officers[tag][0]
             new_contacts.append({
-                    'title': tag[0],
+                    'title': tag,
                     'first_name': user.first_name,
                     'last_name': user.last_name,
-                    'email': tag[1],
-                    'phone': user.phone if tag[0] == 'Ordförande' else None,
-                    'weight': tag[2],
+                    'email': email,
+                    'phone': user.phone if tag == 'Ordförande' else None,
+                    'weight': weight,
                     })
 
-        success = True
+        job = teknologkoren_se.update_contacts.enqueue(new_contacts)
 
-        remote_contacts = teknologkoren_se.get_all_contacts()
+        flash('Updating contacts in the background.', 'info')
+        return redirect(url_for('.job_status', job_id=job.id))
 
-        if remote_contacts:
-            for contact in remote_contacts.json():
-                r = teknologkoren_se.delete_contact(contact['id'])
-                if not r:
-                    success = False
-                    break
+    return render_template('admin/update-contacts.html', form=form)
 
-            for contact in new_contacts:
-                r = teknologkoren_se.new_contact(**contact)
-                if not r:
-                    success = False
-                    break
-        else:
-            success = False
 
-        if success:
-            flash('Contacts updated!', 'success')
-        else:
-            flash('Something went wrong while updating contacts...', 'error')
+@mod.route('/email/')
+@tag_required('Webmaster')
+def bulk_emails():
+    """Show the latest bulk emails and how far they have been sent."""
+    emails = BulkEmail.query.order_by(BulkEmail.created.desc()).limit(50)
 
-    return render_template('admin/update-contacts.html', form=form)
+    return render_template('admin/bulk-emails.html', emails=emails)
+
+
+@mod.route('/email/to/<list:tag_list>/', defaults={'mandatory': None},
+           methods=['GET', 'POST'])
+@mod.route('/email/to/<list:tag_list>/all-<list:mandatory>',
+           methods=['GET', 'POST'])
+@tag_required('Webmaster')
+def new_bulk_email(tag_list, mandatory):
+    """Email active members with any of tag_list and all of mandatory.
+
+    The tags are given like in the members urls. The email is sent in
+    the background, see fernet.bulk_email.
+    """
+    form = forms.BulkEmailForm()
+
+    if form.validate_on_submit():
+        bulk = bulk_email.start(form.subject.data, form.body.data, tag_list,
+                                mandatory, current_user)
+
+        flash('Sending email to {} members.'.format(bulk.total), 'success')
+        return redirect(url_for('.bulk_email_progress', bulk_id=bulk.id))
+
+    else:
+        forms.flash_errors(form)
+
+    count = bulk_email.recipients(tag_list, mandatory).count()
+
+    return render_template('admin/new-bulk-email.html', form=form,
+                           tag_list=tag_list, mandatory=mandatory,
+                           count=count)
+
+
+@mod.route('/email/sent/<int:bulk_id>/')
+@tag_required('Webmaster')
+def bulk_email_progress(bulk_id):
+    """Show how far a bulk email has been sent."""
+    bulk = BulkEmail.query.get_or_404(bulk_id)
+
+    return render_template('admin/bulk-email.html', bulk=bulk,
+                           overdue=bulk.job and jobs.overdue(bulk.job))
+
+
+@mod.route('/jobs/<int:job_id>/')
+@tag_required('Webmaster', 'PRoletär')
+def job_status(job_id):
+    """Show the status of a background job, as json if asked for.
+
+    The page reloads itself until the job is done or has failed.
+    """
+    job = Job.query.get_or_404(job_id)
+
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(id=job.id,
+                       status=job.status,
+                       attempts=job.attempts,
+                       result=json.loads(job.result) if job.result else None,
+                       error=job.error,
+                       overdue=jobs.overdue(job))
+
+    return render_template('admin/job.html', job=job,
+                           overdue=jobs.overdue(job))
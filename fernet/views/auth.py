@@ -1,19 +1,91 @@
+import threading
+import time
 from flask import (Blueprint, request, redirect, render_template, url_for,
                    abort, flash)
 from flask_login import current_user, login_user, logout_user
 from itsdangerous import SignatureExpired
-from fernet import db, login_manager, forms
-from fernet.models import User
+from fernet import app, db, login_manager, forms
+from fernet.models import User, UserTag, on_commit
 from fernet.util import send_email, ts
 
 
 mod = Blueprint('auth', __name__)
 
+# user id -> (expiry, password stamp, detached user, active tag ids),
+# see load_user
+_user_cache = {}
+_user_cache_lock = threading.Lock()
+
 
 @login_manager.user_loader
-def load_user(userid):
-    """Tell flask-login how to get logged in user."""
-    return User.query.get(userid)
+def load_user(session_id):
+    """Tell flask-login how to get logged in user.
+
+    session_id is what User.get_id returned at login: the user id and
+    the password stamp. Sessions with another stamp than the user's
+    current one, started before a password change, are not accepted.
+
+    The user and their active tags are fetched with a single query, and
+    the tags are used for has_tag for the rest of the request.
+
+    If USER_CACHE_TTL is set, the user, password stamp and tag ids are
+    also cached in process for that many seconds. Committing changes to
+    the user (such as a new password) or their tags drops the cached
+    entry in this process, but other processes keep theirs until it
+    expires. Until then, they may accept sessions ended by a password
+    change and show tags that have been removed.
+    """
+    try:
+        user_id, stamp = session_id.split(':', 1)
+        user_id = int(user_id)
+    except ValueError:
+        return None
+
+    ttl = app.config['USER_CACHE_TTL']
+
+    cached = _user_cache.get(user_id) if ttl else None
+    if cached and cached[0] > time.monotonic() and cached[1] == stamp:
+        _, _, user, tag_ids = cached
+
+        # Attach a copy of the cached user to this request's session
+        # without asking the database.
+        user = db.session.merge(user, load=False)
+
+        user.preload_tags(tag_ids)
+        return user
+
+    rows = (db.session.query(User, UserTag.tag_id)
+            .outerjoin(UserTag, (UserTag.user_id == User.id) &
+                                (UserTag.is_active == True))
+            .filter(User.id == user_id)
+            .all())
+
+    if not rows or rows[0][0].password_stamp != stamp:
+        return None
+
+    user = rows[0][0]
+    tag_ids = frozenset(tag_id for _, tag_id in rows if tag_id is not None)
+
+    if ttl:
+        # Cache a detached user and continue with an attached copy.
+        db.session.expunge(user)
+
+        with _user_cache_lock:
+            _user_cache[user_id] = (time.monotonic() + ttl, stamp, user,
+                                    tag_ids)
+
+        user = db.session.merge(user, load=False)
+
+    user.preload_tags(tag_ids)
+    return user
+
+
+@on_commit(UserTag, key=lambda user_tag: user_tag.user_id)
+@on_commit(User, key=lambda user: user.id)
+def _drop_changed_users(user_ids):
+    with _user_cache_lock:
+        for user_id in user_ids:
+            _user_cache.pop(user_id, None)
 
 
 @mod.route('/login/', methods=['GET', 'POST'])
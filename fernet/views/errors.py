@@ -5,6 +5,7 @@ from fernet import app
 
 @app.errorhandler(403)
 @app.errorhandler(404)
+@app.errorhandler(503)
 def handle_error(e):
     try:
         response = render_template('errors/{}.html'.format(e.code))
@@ -1,9 +1,8 @@
 from flask import Blueprint, render_template, redirect, request, url_for, flash
 from flask_login import login_required
-from wtforms.fields import BooleanField, FormField
-from flask_wtf import FlaskForm
-from fernet import app, forms
-from fernet.models import User, Tag
+from wtforms.fields import FormField
+from fernet import app, forms, membership
+from fernet.models import User, tag_registry
 
 mod = Blueprint('members', __name__)
 
@@ -36,15 +35,7 @@ def all_members():
 @mod.route('/members/<list:tag_list>/all-<list:mandatory>')
 def members_by_tags(tag_list, mandatory):
     """Show active members sorted by the tags in tag_list."""
-    users = User.query
-    if mandatory:
-        for tag in mandatory:
-            users = users.filter(User.has_tag(tag))
-
-    tag_dict = {}
-    for tag in tag_list:
-        tag_dict[tag] = users.filter(User.has_tag(tag)
-                                     ).order_by(User.first_name)
+    tag_dict = User.by_tags(tag_list, mandatory)
 
     return render_template(
         'members/members.html',
@@ -57,18 +48,7 @@ def members_by_tags(tag_list, mandatory):
 @mod.route('/members/<list:columns>/<list:rows>/all-<list:mandatory>')
 def member_matrix(columns, rows, mandatory):
     """Show a matrice of members based on their tags."""
-    users = User.query
-    if mandatory:
-        for tag in mandatory:
-            users = users.filter(User.has_tag(tag))
-
-    tag_dict = {}
-    for column in columns:
-        tag_dict[column] = {}
-        for row in rows:
-            filtered = users.filter(User.has_tag(column), User.has_tag(row))
-
-            tag_dict[column][row] = filtered
+    tag_dict = membership.member_matrix(columns, rows, mandatory)
 
     return render_template('members/member_matrix.html',
                            columns=columns,
@@ -77,18 +57,24 @@ def member_matrix(columns, rows, mandatory):
                            mandatory=mandatory)
 
 
-@mod.route('/members/filter/', methods=['GET', 'POST'])
-def filter_members():
-    class F(FlaskForm):
-        pass
+def filter_form(tags):
+    """Return the form class for filter_members, with columns and rows."""
+    def build():
+        TagForm = forms.TagForm.tag_form(tags)
 
-    TagColForm = forms.TagForm.tag_form(Tag.query.all())
-    TagRowForm = forms.TagForm.tag_form(Tag.query.all())
+        class F(forms.FilterMembersForm):
+            col_form = FormField(TagForm)
+            row_form = FormField(TagForm)
 
-    F.col_form = FormField(TagColForm)
-    F.row_form = FormField(TagRowForm)
-    F.only_active = BooleanField('Only active members', default=True)
+        return F
 
+    return forms.TagForm.cached_class(
+        ('filter_members', forms.TagForm.catalogue(tags)), build)
+
+
+@mod.route('/members/filter/', methods=['GET', 'POST'])
+def filter_members():
+    F = filter_form(tag_registry.all())
     form = F()
 
     if form.validate_on_submit():
@@ -1,5 +1,5 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash
-from flask_login import current_user, login_required
+from flask_login import current_user, login_required, login_user
 from fernet import app, db, forms
 from fernet.views.auth import verify_email
 from fernet.models import User
@@ -67,6 +67,13 @@ def change_password():
     if form.validate_on_submit():
         current_user.password = form.new_password.data
         db.session.commit()
+
+        # The new password ends all sessions, start a new one here.
+        remember_cookie = app.config.get('REMEMBER_COOKIE_NAME',
+                                         'remember_token')
+        login_user(current_user._get_current_object(),
+                   remember=remember_cookie in request.cookies)
+
         flash('Your password has been changed!', 'success')
         return redirect(url_for('.member', id=current_user.id))
     else:
@@ -0,0 +1,67 @@
+"""Change notifications from teknologkoren.se.
+
+teknologkoren.se posts json like {"type": "post", "id": 3} here when a
+post, event or contact changes, with "deleted": true if it was
+removed. The body is signed with TEKNOLOGKORENSE_WEBHOOK_SECRET, the
+X-Fernet-Signature header being "sha256=" and the hex HMAC-SHA256 of
+the body.
+
+Changed posts and events are fetched into the mirror (see
+teknologkoren_se.sync_collection), deleted ones are removed from it.
+Contacts are not kept locally, so there is nothing to update for them.
+"""
+import hashlib
+import hmac
+from flask import Blueprint, abort, request
+from fernet import app, teknologkoren_se
+
+mod = Blueprint('webhooks', __name__, url_prefix='/webhooks')
+
+# notification type -> mirrored collection, None if not mirrored
+COLLECTIONS = {
+    'post': 'posts',
+    'event': 'events',
+    'contact': None,
+}
+
+
+def verify_signature(body, signature):
+    """Return whether signature is the signature of body."""
+    secret = app.config['TEKNOLOGKORENSE_WEBHOOK_SECRET'].encode('utf-8')
+    expected = 'sha256=' + hmac.new(secret, body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or '')
+
+
+@mod.route('/teknologkoren-se/', methods=['POST'])
+def teknologkoren_se_changed():
+    """Update the mirrored entry a notification is about.
+
+    Responds 204 when done, or 502 if the entry could not be fetched,
+    so that the notification can be sent again. An entry that no longer
+    exists is removed. Nobody sees messages flashed here, so errors are
+    logged instead.
+    """
+    if not app.config['TEKNOLOGKORENSE_WEBHOOK_SECRET']:
+        abort(404)
+
+    if not verify_signature(request.get_data(),
+                            request.headers.get('X-Fernet-Signature')):
+        abort(403)
+
+    notification = request.get_json(silent=True)
+    try:
+        collection = COLLECTIONS[notification['type']]
+        item_id = int(notification['id'])
+    except (KeyError, TypeError, ValueError):
+        abort(400)
+
+    if collection is None:
+        return '', 204
+
+    if notification.get('deleted'):
+        teknologkoren_se.unmirror_item(collection, item_id)
+    elif not teknologkoren_se.refresh_item(collection, item_id,
+                                           report=app.logger.warning):
+        abort(502)
+
+    return '', 204
@@ -1,6 +1,6 @@
 from flask_script import Manager, prompt, prompt_pass
 
-from fernet import app, db
+from fernet import app, db, jobs, teknologkoren_se
 from fernet.models import Tag, User, UserTag
 
 manager = Manager(app)
@@ -67,6 +67,18 @@ def create_webmaster():
     db.session.commit()
 
 
+@manager.command
+def sync_mirror():
+    """Sync the local mirror of teknologkoren.se posts and events."""
+    teknologkoren_se.sync_mirror()
+
+
+@manager.command
+def run_worker(threads=1):
+    """Run background jobs until interrupted."""
+    jobs.run_worker(int(threads))
+
+
 @manager.command
 def full_setup():
     """First time setup of database."""
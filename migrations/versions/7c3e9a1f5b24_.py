@@ -0,0 +1,72 @@
+"""Give user_tag a surrogate key, to keep every membership interval
+
+Revision ID: 7c3e9a1f5b24
+Revises: e61b4c8d2a70
+Create Date: 2026-10-19 11:03:27.640512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c3e9a1f5b24'
+down_revision = 'e61b4c8d2a70'
+branch_labels = None
+depends_on = None
+
+
+def create_user_tag(name, surrogate_key):
+    """Create a user_tag table called name, keyed by id if surrogate_key,
+    else by user_id and tag_id."""
+    if surrogate_key:
+        key = [sa.Column('id', sa.Integer(), nullable=False)]
+        primary_key = sa.PrimaryKeyConstraint('id')
+    else:
+        key = []
+        primary_key = sa.PrimaryKeyConstraint('user_id', 'tag_id')
+
+    op.create_table(name,
+    *key,
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.Column('start', sa.DateTime(), nullable=False),
+    sa.Column('end', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    primary_key
+    )
+
+def replace_user_tag(new_table, where=''):
+    """Copy the rows of user_tag matching where to new_table, and make it
+    the user_tag table."""
+    with op.batch_alter_table('user_tag', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_tag_user_id_tag_id_start_end')
+        batch_op.drop_index('ix_user_tag_tag_id_user_id_start_end')
+
+    op.execute('INSERT INTO {} (user_id, tag_id, start, "end") '
+               'SELECT user_id, tag_id, start, "end" FROM user_tag {}'
+               .format(new_table, where))
+    op.drop_table('user_tag')
+    op.rename_table(new_table, 'user_tag')
+
+    with op.batch_alter_table('user_tag', schema=None) as batch_op:
+        batch_op.create_index('ix_user_tag_tag_id_user_id_start_end',
+                              ['tag_id', 'user_id', 'start', 'end'],
+                              unique=False)
+        batch_op.create_index('ix_user_tag_user_id_tag_id_start_end',
+                              ['user_id', 'tag_id', 'start', 'end'],
+                              unique=False)
+
+
+def upgrade():
+    create_user_tag('_user_tag_new', surrogate_key=True)
+    replace_user_tag('_user_tag_new')
+
+
+def downgrade():
+    # Only one association per user and tag fits, keep the latest.
+    create_user_tag('_user_tag_old', surrogate_key=False)
+    replace_user_tag('_user_tag_old',
+                     'WHERE id IN (SELECT max(id) FROM user_tag '
+                     'GROUP BY user_id, tag_id)')